@@ -5,8 +5,14 @@ __all__ = ["index", "modules", "custom_doc_links", "git_url"]
 index = {"import_data": "core.ipynb",
          "import_from_files": "core.ipynb",
          "import_from_csv": "core.ipynb",
+         "stream_from_files": "core.ipynb",
+         "stream_from_csv": "core.ipynb",
+         "read_streamed": "core.ipynb",
+         "get_expansion_stats": "core.ipynb",
          "create_tfidf": "core.ipynb",
+         "create_tfidf_streaming": "core.ipynb",
          "get_phrases": "core.ipynb",
+         "compare_sentiment_modes": "core.ipynb",
          "get_vectors": "core.ipynb",
          "assign_clusters": "core.ipynb",
          "reassign_hac_clusters": "core.ipynb",
@@ -15,34 +21,110 @@ index = {"import_data": "core.ipynb",
          "visualize_df": "core.ipynb",
          "get_cluster_topics": "core.ipynb",
          "recluster": "core.ipynb",
+         "TopExModel": "core.ipynb",
          "get_doc_topics": "core.ipynb",
          "evaluate": "core.ipynb",
+         "sweep_clusters": "core.ipynb",
+         "sweep": "core.ipynb",
          "score_phrase": "internal.ipynb",
+         "get_polarity": "internal.ipynb",
+         "get_sentiment_lexicon": "internal.ipynb",
          "score_token": "internal.ipynb",
          "get_phrase": "internal.ipynb",
+         "get_max_token_scores": "internal.ipynb",
+         "get_token_scores": "internal.ipynb",
+         "get_window_scores": "internal.ipynb",
+         "get_window_polarity": "internal.ipynb",
+         "get_phrases_batch": "internal.ipynb",
          "get_vector_tfidf": "internal.ipynb",
          "get_vector_w2v": "internal.ipynb",
+         "get_w2v_term_index": "internal.ipynb",
+         "get_term_subset": "internal.ipynb",
+         "get_phrase_term_matrix": "internal.ipynb",
+         "get_phrase_vectors": "internal.ipynb",
+         "get_vector_matrix": "internal.ipynb",
          "w2v_pretrained": "internal.ipynb",
+         "get_w2v_native_file": "internal.ipynb",
+         "load_w2v_native": "internal.ipynb",
+         "get_w2v_subset": "internal.ipynb",
+         "w2v_local": "internal.ipynb",
+         "get_w2v_fingerprint": "internal.ipynb",
          "get_cluster_assignments_hac": "internal.ipynb",
          "get_silhouette_score_hac": "internal.ipynb",
          "get_tree_height": "internal.ipynb",
+         "get_height_scores": "internal.ipynb",
          "get_optimal_height": "internal.ipynb",
+         "get_linkage_knn": "internal.ipynb",
+         "get_linkage_matrix": "internal.ipynb",
          "get_clusters_hac": "internal.ipynb",
          "get_silhouette_score_kmeans": "internal.ipynb",
+         "get_silhouette_score_labels": "internal.ipynb",
+         "score_k_chain": "internal.ipynb",
+         "get_k_scores": "internal.ipynb",
          "get_optimal_k": "internal.ipynb",
+         "iter_vector_chunks": "internal.ipynb",
+         "fit_kmeans": "internal.ipynb",
+         "predict_kmeans": "internal.ipynb",
          "get_cluster_assignments_kmeans": "internal.ipynb",
          "get_clusters_kmeans": "internal.ipynb",
          "get_topics_from_docs": "internal.ipynb",
+         "get_term_counts": "internal.ipynb",
+         "get_topics_ctfidf": "internal.ipynb",
+         "get_group_topics": "internal.ipynb",
+         "get_group_topics_cached": "internal.ipynb",
          "df_to_disk": "internal.ipynb",
          "sentences_to_disk": "internal.ipynb",
          "write_cluster": "internal.ipynb",
          "clusters_to_disk": "internal.ipynb",
-         "nlp": "preprocessing.ipynb",
-         "linker": "preprocessing.ipynb",
+         "get_contingency_matrix": "internal.ipynb",
+         "get_contingency_metrics": "internal.ipynb",
+         "fit_projection": "internal.ipynb",
+         "place_by_neighbors": "internal.ipynb",
+         "get_projection": "internal.ipynb",
+         "get_projection_cached": "internal.ipynb",
+         "downsample_clusters": "internal.ipynb",
+         "get_count_matrix": "internal.ipynb",
+         "get_tfidf_matrix": "internal.ipynb",
+         "get_source_fingerprint": "internal.ipynb",
+         "save_corpus_stats": "internal.ipynb",
+         "load_corpus_stats": "internal.ipynb",
+         "merge_corpus_stats": "internal.ipynb",
+         "HashedVocab": "internal.ipynb",
+         "get_hash_dictionary": "internal.ipynb",
+         "get_index_meta": "internal.ipynb",
+         "load_index_meta": "internal.ipynb",
+         "tokens_to_disk": "internal.ipynb",
+         "iter_token_file": "internal.ipynb",
+         "get_kept_terms": "internal.ipynb",
+         "get_tfidf_matrix_streaming": "internal.ipynb",
+         "load_sparse_matrix": "internal.ipynb",
+         "get_nlp": "preprocessing.ipynb",
+         "get_linker_pipes": "preprocessing.ipynb",
+         "add_linker": "preprocessing.ipynb",
+         "LINKER_PIPES": "preprocessing.ipynb",
          "token_filter": "preprocessing.ipynb",
          "normalize_entity": "preprocessing.ipynb",
+         "parse_doc": "preprocessing.ipynb",
+         "decode_parsed_doc": "preprocessing.ipynb",
+         "parse_texts": "preprocessing.ipynb",
+         "parse_batch": "preprocessing.ipynb",
+         "iter_parsed_docs": "preprocessing.ipynb",
          "preprocess_docs": "preprocessing.ipynb",
-         "get_stop_words": "preprocessing.ipynb"}
+         "stream_docs": "preprocessing.ipynb",
+         "get_stop_words": "preprocessing.ipynb",
+         "get_parse_config": "preprocessing.ipynb",
+         "get_cache_key": "preprocessing.ipynb",
+         "encode_strings": "preprocessing.ipynb",
+         "decode_strings": "preprocessing.ipynb",
+         "save_parsed_shard": "preprocessing.ipynb",
+         "load_parsed_shard": "preprocessing.ipynb",
+         "add_shard_to_index": "preprocessing.ipynb",
+         "load_cache_index": "preprocessing.ipynb",
+         "find_parsed_docs": "preprocessing.ipynb",
+         "get_parsed_doc": "preprocessing.ipynb",
+         "CACHE_FORMAT": "preprocessing.ipynb",
+         "PARSED_ARRAYS": "preprocessing.ipynb",
+         "PARSED_STRINGS": "preprocessing.ipynb"}
 
 modules = ["core.py",
            "internal.py",
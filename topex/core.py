@@ -1,42 +1,53 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: core.ipynb (unless otherwise specified).
 
-__all__ = ['import_data', 'import_from_files', 'import_from_csv', 'create_tfidf', 'get_phrases', 'get_vectors',
-           'assign_clusters', 'reassign_hac_clusters', 'reassign_kmeans_clusters', 'visualize_clustering',
-           'visualize_df', 'get_cluster_topics', 'recluster', 'get_doc_topics', 'evaluate']
+__all__ = ['import_data', 'import_from_files', 'import_from_csv', 'stream_from_files', 'stream_from_csv',
+           'read_streamed', 'get_expansion_stats', 'create_tfidf', 'create_tfidf_streaming', 'get_phrases',
+           'compare_sentiment_modes', 'get_vectors', 'assign_clusters', 'reassign_hac_clusters',
+           'reassign_kmeans_clusters', 'visualize_clustering', 'visualize_df', 'get_cluster_topics', 'recluster',
+           'TopExModel', 'get_doc_topics', 'evaluate', 'sweep_clusters', 'sweep']
 
 # Cell
 import gensim
-from gensim import corpora, models, matutils
-import matplotlib.pyplot as plt
+from gensim import corpora
 import topex.internal as internal
 import topex.preprocessing as preprocessing
 import numpy as np
+import itertools
+from itertools import islice
+from joblib import Parallel, delayed
+import json
 import os
 import pandas as pd
 from pandas import DataFrame, Series
-import plotly
-import plotly.express as px
-from sklearn.manifold import MDS, TSNE
-from sklearn.metrics import silhouette_score, pairwise_distances
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse
+import time
+from sklearn.cluster import KMeans
+from sklearn.metrics import pairwise_distances_argmin
 from sklearn.decomposition import TruncatedSVD
-import umap.umap_ as umap
+
+# umap, plotly and sklearn.manifold are slow to import, so they are imported by the functions that use them
 
 # Cell
 def import_data(raw_docs:DataFrame, save_results:bool=False, file_name:str=None, stop_words_file:str=None,
-                stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False):
+                stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False, n_process:int=1,
+                batch_size:int=1000, nlp=None, cache_dir:str=None):
     """
     Imports and pre-processes the documents from the `raw_docs` dataframe
 
     Document pre-processing is handled in [`tokenize_and_stem`](/topex/preprocessing#tokenize_and_stem).
     `path_to_file_list` is a path to a text file containing a list of files to be processed separated by line breaks.
+    `n_process` is the number of worker processes used to parse documents and `batch_size` is the number of documents
+    sent to a worker at a time. `nlp` is an optional, preconfigured spaCy pipeline to use instead of the default
+    scispaCy model, which is loaded on first use. When `cache_dir` is set, parsed documents are cached on disk by
+    content and settings, so re-imports only parse new or changed documents.
 
     Returns (DataFrame, DataFrame)
     """
 
     raw_docs['id'] = range(len(raw_docs))
     data, doc_df = preprocessing.preprocess_docs(raw_docs, save_results, file_name, stop_words_file=stop_words_file,
-                               stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only, ner=ner)
+                               stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only, ner=ner,
+                               n_process=n_process, batch_size=batch_size, nlp=nlp, cache_dir=cache_dir)
 
     # Optionally save the results to disk
     if save_results:
@@ -45,9 +56,11 @@ def import_data(raw_docs:DataFrame, save_results:bool=False, file_name:str=None,
     return data, doc_df
 
 def import_from_files(path_to_file_list:str, save_results:bool = False, file_name:str = 'output/DocumentSentenceList.txt',
-               stop_words_file:str = None, stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False):
+               stop_words_file:str = None, stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False,
+               n_process:int=1, batch_size:int=1000, nlp=None, cache_dir:str=None):
     """
     Imports and pre-processes a list of documents contained in `path_to_file_list`.
+    `n_process`, `batch_size`, `nlp` and `cache_dir` are passed through as in `import_data`.
     Returns (DataFrame, DataFrame)
     """
     # Extract list of files from the text document
@@ -64,28 +77,142 @@ def import_from_files(path_to_file_list:str, save_results:bool = False, file_nam
 
     raw_docs = DataFrame(dict(id=range(len(docs)), doc_name=file_list, text=docs))
     data, doc_df = preprocessing.preprocess_docs(raw_docs, save_results, file_name, stop_words_file=stop_words_file,
-                               stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only, ner=ner)
+                               stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only, ner=ner,
+                               n_process=n_process, batch_size=batch_size, nlp=nlp, cache_dir=cache_dir)
     return data, doc_df
 
 def import_from_csv(path_to_csv:str, save_results:bool = False, file_name:str = 'output/DocumentSentenceList.txt',
-               stop_words_file:str = None, stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False):
+               stop_words_file:str = None, stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False,
+               n_process:int=1, batch_size:int=1000, nlp=None, cache_dir:str=None):
     """
     Imports and pre-processes documents from a pipe-demilited csv file. File should be formatted with two columns:
     "doc_name" and "text"
+    `n_process`, `batch_size`, `nlp` and `cache_dir` are passed through as in `import_data`.
 
     Returns (DataFrame, DataFrame)
     """
     raw_docs = pd.read_csv(path_to_csv, sep='|')
     raw_docs['id'] = range(len(raw_docs))
     data, doc_df = preprocessing.preprocess_docs(raw_docs, save_results, file_name, stop_words_file=stop_words_file,
-                               stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only, ner=ner)
+                               stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only, ner=ner,
+                               n_process=n_process, batch_size=batch_size, nlp=nlp, cache_dir=cache_dir)
     return data, doc_df
 
+def stream_from_files(path_to_file_list:str, file_name:str = 'output/DocumentSentenceList.parquet',
+                      doc_file_name:str = 'output/DocumentList.parquet', chunk_size:int = 1000,
+                      stop_words_file:str = None, stop_words_list:list=None, custom_stopwords_only:bool=False,
+                      ner:bool=False, n_process:int=1, batch_size:int=1000, nlp=None, cache_dir:str=None):
+    """
+    Imports and pre-processes a list of documents contained in `path_to_file_list` without loading the whole corpus
+    into memory. Documents are read and parsed `chunk_size` at a time and the sentence and document tables are
+    appended to the Parquet files `file_name` and `doc_file_name` after each chunk (requires `pyarrow`).
+    The tables have the same columns as the output of `import_from_files`; load them with `read_streamed`, which
+    returns the token and part of speech columns as lists like `import_from_files` does (`pd.read_parquet` returns
+    numpy arrays). Document names are written as strings. Other options are the same as in `import_data`.
+
+    Returns (int, int) the number of documents and sentences written
+    """
+    def read_chunks():
+        with open(path_to_file_list, encoding="utf-8") as file:
+            file_list = (line.strip() for line in file if line.strip())
+            while True:
+                chunk = list(islice(file_list, chunk_size))
+                if len(chunk) == 0:
+                    break
+                docs = []
+                for doc_file in chunk:
+                    with open(doc_file, encoding="utf-8") as file_content:
+                        docs.append(file_content.read())
+                yield DataFrame(dict(doc_name=chunk, text=docs))
+
+    return preprocessing.stream_docs(read_chunks(), file_name, doc_file_name, stop_words_file=stop_words_file,
+                                     stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only,
+                                     ner=ner, n_process=n_process, batch_size=batch_size, nlp=nlp, cache_dir=cache_dir)
+
+def stream_from_csv(path_to_csv:str, file_name:str = 'output/DocumentSentenceList.parquet',
+                    doc_file_name:str = 'output/DocumentList.parquet', chunk_size:int = 1000,
+                    stop_words_file:str = None, stop_words_list:list=None, custom_stopwords_only:bool=False,
+                    ner:bool=False, n_process:int=1, batch_size:int=1000, nlp=None, cache_dir:str=None):
+    """
+    Imports and pre-processes documents from a pipe-delimited csv file (see `import_from_csv`) without loading the
+    whole file into memory. Options are the same as in `stream_from_files`.
+
+    Returns (int, int) the number of documents and sentences written
+    """
+    raw_doc_chunks = pd.read_csv(path_to_csv, sep='|', chunksize=chunk_size)
+    return preprocessing.stream_docs(raw_doc_chunks, file_name, doc_file_name, stop_words_file=stop_words_file,
+                                     stop_words_list=stop_words_list, custom_stopwords_only=custom_stopwords_only,
+                                     ner=ner, n_process=n_process, batch_size=batch_size, nlp=nlp, cache_dir=cache_dir)
+
+def read_streamed(file_name:str):
+    """
+    Loads a sentence or document table written by `stream_from_files` or `stream_from_csv`, with the "tokens" and
+    "pos_tags" columns as lists.
+
+    Returns DataFrame
+    """
+    df = pd.read_parquet(file_name)
+    for col in ('tokens', 'pos_tags'):
+        if col in df.columns:
+            df[col] = [list(values) for values in df[col]]
+    return df
+
 # Cell
+def get_expansion_stats(path_to_expansion_file_list:str=None, path_to_expansion_csv:str=None,
+                        expansion_df:DataFrame=None, stats_dir:str=None):
+    """
+    Gets the dictionary and (terms x documents) token count matrix of the expansion corpus.
+
+    The expansion corpus is loaded from `path_to_expansion_file_list`, `path_to_expansion_csv` or `expansion_df` as in
+    `create_tfidf`. When `stats_dir` is set, the results are saved there with a fingerprint of the corpus source (the
+    size and modification time of its files, or the text of `expansion_df`) and loaded from there on later calls
+    without importing the corpus again, unless the source has changed. When no expansion source is passed, the saved
+    results are loaded as is.
+
+    Returns (gensim.corpora.dictionary.Dictionary, scipy.sparse.csc_matrix)
+    """
+    # Fingerprint the expansion corpus without importing it
+    if path_to_expansion_file_list is not None:
+        with open(path_to_expansion_file_list, encoding="utf-8") as file:
+            file_list = file.read().strip().split('\n')
+        fingerprint = internal.get_source_fingerprint(paths=[path_to_expansion_file_list] + file_list)
+    elif path_to_expansion_csv is not None:
+        fingerprint = internal.get_source_fingerprint(paths=[path_to_expansion_csv])
+    elif expansion_df is not None:
+        fingerprint = internal.get_source_fingerprint(df=expansion_df[['text']])
+    else:
+        fingerprint = None
+
+    # Optionally load the saved statistics if they come from the same corpus
+    if stats_dir is not None:
+        stats = internal.load_corpus_stats(stats_dir, fingerprint)
+        if stats is not None:
+            return stats
+
+    expansion_docs_df = None
+    if path_to_expansion_file_list is not None:
+        _, expansion_docs_df = import_from_files(path_to_expansion_file_list)
+    elif path_to_expansion_csv is not None:
+        _, expansion_docs_df = import_from_csv(path_to_expansion_csv)
+    elif expansion_df is not None:
+        _, expansion_docs_df = import_data(expansion_df)
+
+    assert expansion_docs_df is not None, f"Unable to load expansion docs. Check expansion parameter or set tfidf_corpus to 'clustering'."
+
+    expansion_docs = list(expansion_docs_df.tokens)
+    dictionary = corpora.Dictionary(expansion_docs)
+    counts = internal.get_count_matrix(expansion_docs, dictionary)
+
+    # Optionally save the statistics for later runs
+    if stats_dir is not None:
+        internal.save_corpus_stats(dictionary, counts, stats_dir, fingerprint)
+    return dictionary, counts
+
 def create_tfidf(tfidf_corpus:str='both', doc_df:DataFrame=None, path_to_expansion_file_list:str=None,
-                 path_to_expansion_csv:str=None, expansion_df:DataFrame=None):
+                 path_to_expansion_csv:str=None, expansion_df:DataFrame=None, sparse:bool=False,
+                 expansion_stats_dir:str=None):
     """
-    Creates a dense TF-IDF matrix from the tokens in some combination of the clustering corpus and/or expansion corpus.
+    Creates a TF-IDF matrix from the tokens in some combination of the clustering corpus and/or expansion corpus.
     This combination is determined by `tfidf_corpus` which has possible values (both, clustering, expansion).
 
     `path_to_seed_topics_file_list` is a path to a text file containing a list of files with sentences corresponding to
@@ -93,43 +220,62 @@ def create_tfidf(tfidf_corpus:str='both', doc_df:DataFrame=None, path_to_expansi
     pipe-delimited csv file. If the `doc_df` is passed, the input corpus will be used along with the seed topics documents
     to generate the TF-IDF matrix.
 
-    Returns (numpy.ndarray, gensim.corpora.dictionary.Dictionary)
-    """
-    # Bag of Words (BoW) is a list of all tokens by document
-    bow_docs = []
+    The matrix is dense (terms x documents) by default. Pass `sparse=True` for large corpora to get a
+    scipy.sparse.csr_matrix instead, which is accepted everywhere the dense matrix is.
+    When `expansion_stats_dir` is set, the expansion corpus's dictionary and token counts are saved there once and
+    reused by later calls (see `get_expansion_stats`), so only the clustering corpus is counted on each run.
 
-    # Add clustering corpus to BoW
+    Returns (numpy.ndarray or scipy.sparse.csr_matrix, gensim.corpora.dictionary.Dictionary)
+    """
+    # Count the tokens of the clustering corpus
     if tfidf_corpus in ('both','clustering'):
         assert doc_df is not None, f"Optional parameter: 'doc_df' is required for tfidf_corpus: {tfidf_corpus}."
-        bow_docs = bow_docs + list(doc_df.tokens)
+        clustering_docs = list(doc_df.tokens)
+        dictionary = corpora.Dictionary(clustering_docs)
+        counts = internal.get_count_matrix(clustering_docs, dictionary)
+    else:
+        dictionary = corpora.Dictionary()
+        counts = scipy.sparse.csc_matrix((0, 0))
 
-    # Add expansion corpus to BoW
+    # Add the counts of the expansion corpus after the clustering corpus
     if tfidf_corpus in ('both','expansion'):
-        expansion_docs_df = None
-        if path_to_expansion_file_list is not None:
-            _, expansion_docs_df = import_from_files(path_to_expansion_file_list)
-        elif path_to_expansion_csv is not None:
-            _, expansion_docs_df = import_from_csv(path_to_expansion_csv)
-        elif expansion_df is not None:
-            _, expansion_docs_df = import_data(expansion_df)
+        expansion_dictionary, expansion_counts = get_expansion_stats(path_to_expansion_file_list, path_to_expansion_csv,
+                                                                     expansion_df, expansion_stats_dir)
+        dictionary, counts = internal.merge_corpus_stats(dictionary, counts, expansion_dictionary, expansion_counts)
 
-        assert expansion_docs_df is not None, f"Unable to load expansion docs. Check expansion parameter or set tfidf_corpus to 'clustering'."
+    # Create a TF-IDF matrix from the token counts of all documents
+    tfidf = internal.get_tfidf_matrix(counts)
 
-        bow_docs = bow_docs + list(expansion_docs_df.tokens)
+    # Sparse matrices are stored row-wise (CSR) since downstream steps look up scores by token
+    if sparse:
+        tfidf_matrix = tfidf.astype(np.float32).tocsr()
+    else:
+        tfidf_matrix = tfidf.astype(np.float32).toarray()
 
-    # Create a dense TF-IDF matrix using document tokens and gensim
-    dictionary = corpora.Dictionary(bow_docs)
-    corpus = [dictionary.doc2bow(text) for text in bow_docs]
-    tfidf = models.TfidfModel(corpus)
-    corpus_tfidf = tfidf[corpus]
-    num_terms = len(corpus_tfidf.obj.idfs)
-    tfidf_dense = matutils.corpus2dense(corpus_tfidf, num_terms)
+    return tfidf_matrix, dictionary
 
-    return tfidf_dense, dictionary
+def create_tfidf_streaming(token_file:str, chunk_size:int = 100000, no_below:int = 1, no_above:float = 1.0,
+                           keep_n:int = None, hashing:bool = False, n_features:int = 2**18, output_dir:str = None):
+    """
+    Creates a sparse (terms x documents) TF-IDF matrix from a corpus too large to import into memory at once.
+
+    `token_file` has one document per line as a JSON list of tokens; write it with `internal.tokens_to_disk`,
+    starting with the clustering corpus so that its sentences keep their `doc_id` columns. The file is read twice,
+    `chunk_size` documents at a time. Terms in fewer than `no_below` documents or more than `no_above` (fraction) of
+    documents are dropped, and then all but the `keep_n` most frequent terms. When `hashing` is True, tokens are hashed
+    to `n_features` ids instead of building a vocabulary. When `output_dir` is set, the matrix is written there chunk by
+    chunk and returned memory-mapped, so it doesn't have to fit in memory; reload it with `internal.load_sparse_matrix`.
+
+    Returns (scipy.sparse.csr_matrix, gensim.corpora.dictionary.Dictionary or gensim.corpora.hashdictionary.HashDictionary)
+    """
+    return internal.get_tfidf_matrix_streaming(token_file, chunk_size=chunk_size, no_below=no_below, no_above=no_above,
+                                               keep_n=keep_n, hashing=hashing, n_features=n_features,
+                                               output_dir=output_dir)
 
 # Cell
 def get_phrases(data:DataFrame, vocab:dict, tfidf:np.ndarray, window_size:int = 6,
-                tfidf_corpus:str='clustering', include_sentiment:bool=True):
+                tfidf_corpus:str='clustering', include_sentiment:bool=True, batch_size:int=100000,
+                sentiment_mode:str='exact'):
     """
     Extracts the most expressive phrase from each sentence.
 
@@ -138,21 +284,27 @@ def get_phrases(data:DataFrame, vocab:dict, tfidf:np.ndarray, window_size:int =
     (IMPORTANT: this option requires aggregating vectors in the next step.)
     When `tfidf_corpus='clustering'`, token_scores are calculated using the TF-IDF, otherwise, token_scores
     are calculated using `max_token_scores` (max scores for each token in all documents. When `include_sentiment` is False,
-    sentiment and token part of speech are ignored when scoring phrases.
+    sentiment and token part of speech are ignored when scoring phrases. `tfidf` may be dense or sparse.
+    Sentences are scored `batch_size` at a time.
+    Options for `sentiment_mode` are ('exact', 'fast'). 'exact' weights phrases by their TextBlob polarity. 'fast'
+    approximates polarity from a per-token lexicon, which is much quicker but ignores modifiers and negations
+    (see `compare_sentiment_modes`).
 
     Returns DataFrame
     """
+    if sentiment_mode not in ('exact', 'fast'):
+        raise Exception(f"Unrecognized sentiment_mode: '{sentiment_mode}'")
+
     if window_size > 0:
-        max_token_scores = np.max(tfidf, axis=1)
+        max_token_scores = internal.get_max_token_scores(tfidf)
 
         # Remove records where len(tokens) < window_size
         filtered_df = data[data.tokens.map(len)>=window_size].copy().reset_index(drop=True)
         print(f"Removed {len(data) - len(filtered_df)} sentences without phrases.")
 
         # Find the most expressive phrase for each sentence and add to dataframe
-        lambda_func = lambda sent: internal.get_phrase(sent, window_size, vocab, tfidf_corpus, tfidf,
-                                                       max_token_scores, include_sentiment)
-        phrases = filtered_df.apply(lambda_func, axis=1)
+        phrases = internal.get_phrases_batch(filtered_df, window_size, vocab, tfidf_corpus, tfidf, max_token_scores,
+                                             include_sentiment, batch_size=batch_size, sentiment_mode=sentiment_mode)
         filtered_df['phrase'] = phrases
     else:
         # Remove records with no tokens
@@ -163,92 +315,159 @@ def get_phrases(data:DataFrame, vocab:dict, tfidf:np.ndarray, window_size:int =
 
     return filtered_df
 
+def compare_sentiment_modes(data:DataFrame, vocab:dict, tfidf:np.ndarray, window_size:int = 6,
+                            tfidf_corpus:str='clustering'):
+    """
+    Benchmarks the 'fast' sentiment mode of `get_phrases` against the 'exact' mode on the same sentences.
+
+    `phrase_agreement` is the fraction of sentences where both modes pick the same phrase and `token_overlap` is the
+    mean fraction of phrase tokens shared by both modes. Timings are in seconds. The exact mode is timed with an empty
+    polarity cache.
+
+    Returns Series
+    """
+    filtered_df = data[data.tokens.map(len)>=window_size].reset_index(drop=True)
+    max_token_scores = internal.get_max_token_scores(tfidf)
+
+    # Extract phrases with both sentiment modes
+    timings, phrases = {}, {}
+    internal.get_polarity.cache_clear()
+    for mode in ('exact', 'fast'):
+        start = time.perf_counter()
+        phrases[mode] = internal.get_phrases_batch(filtered_df, window_size, vocab, tfidf_corpus, tfidf,
+                                                   max_token_scores, True, sentiment_mode=mode)
+        timings[mode] = time.perf_counter() - start
+
+    # Compare the phrase chosen for each sentence
+    same = [e == f for e, f in zip(phrases['exact'], phrases['fast'])]
+    overlap = [len(set(e) & set(f)) / len(set(e)) for e, f in zip(phrases['exact'], phrases['fast'])]
+
+    return Series(dict(sentences=len(filtered_df), exact_seconds=timings['exact'], fast_seconds=timings['fast'],
+                       phrase_agreement=np.mean(same) if same else float("Nan"),
+                       token_overlap=np.mean(overlap) if overlap else float("Nan")))
+
 # Cell
 def get_vectors(method:str, data:DataFrame, dictionary:gensim.corpora.dictionary.Dictionary = None,
                 tfidf:np.ndarray = None, dimensions:int = 2, umap_neighbors:int = 15,
-                path_to_w2v_bin_file:str = None, doc_df:DataFrame = None):
+                path_to_w2v_bin_file:str = None, doc_df:DataFrame = None, return_term_vectors:bool = False,
+                w2v_vocab_subset:bool = False, w2v_cache_dir:str = None, w2v_workers:int = 3, w2v_epochs:int = 500,
+                w2v_patience:int = None, w2v_corpus_file:str = None):
     """
     Creates a word vector for each phrase in the dataframe.
 
     Options for `method` are ('tfidf', 'svd', 'umap', 'pretrained', 'local'). Options for `method` are ('tfidf', 'svd', 'umap', 'pretrained', 'local').`tfidf` and `dictionary` are output from
     `create_tfidf`. `dimensions` is the number of dimensions to which SVD or UMAP reduce the TF-IDF matrix.
-    `path_to_w2v_bin_file` is the path to a pretrained Word2Vec .bin file.
-
-    Returns DataFrame
+    `path_to_w2v_bin_file` is the path to a pretrained Word2Vec .bin file, which is converted once to a memory-mapped
+    copy next to it (or in `w2v_cache_dir`). When `w2v_vocab_subset` is True, only the vectors of the phrase tokens
+    are loaded from the pretrained model. For method 'local', `w2v_workers`, `w2v_epochs`, `w2v_patience` and
+    `w2v_corpus_file` are passed to `internal.w2v_local` and trained models are cached in `w2v_cache_dir` when it is
+    set. When `return_term_vectors` is True, the matrix of term vectors that phrase vectors are summed from and the
+    index of each term in it are also returned, which is what `TopExModel` needs to vectorize new sentences.
+
+    Returns DataFrame or (DataFrame, np.ndarray, dict)
     """
 
     # Create word vectors with TF-IDF
     if method == "tfidf":
         assert dictionary is not None, "Optional parameter: 'dictionary' is required for method: 'tfidf'."
         assert tfidf is not None, "Optional parameter: 'tfidf' is required for method: 'tfidf'."
-        lambda_func = lambda sent: internal.get_vector_tfidf(sent, dictionary, tfidf)
+        term_vectors = tfidf
 
     # Create word vectors with SVD transformed TF-IDF
     elif method == "svd":
         assert dictionary is not None, "Optional parameter: 'dictionary' is required for method: 'svd'."
         assert tfidf is not None, "Optional parameter: 'tfidf' is required for method: 'svd'."
         svd =  TruncatedSVD(n_components = dimensions, random_state = 42)
-        tfidf_transf = svd.fit_transform(tfidf)
-        lambda_func = lambda sent: internal.get_vector_tfidf(sent, dictionary, tfidf_transf)
+        term_vectors = svd.fit_transform(tfidf)
 
     # Create word vectors with UMAP transformed TF-IDF
     elif method == "umap":
         assert dictionary is not None, "Optional parameter: 'dictionary' is required for method: 'umap'."
         assert tfidf is not None, "Optional parameter: 'tfidf' is required for method: 'umap'."
+        import umap.umap_ as umap
         reducer = umap.UMAP(n_neighbors=umap_neighbors, min_dist=.1, metric='cosine', random_state=42, n_components=dimensions)
-        embed = reducer.fit_transform(tfidf)
-        lambda_func = lambda sent: internal.get_vector_tfidf(sent, dictionary, embed)
+        term_vectors = reducer.fit_transform(tfidf)
 
     # Create word vectors using a pre-trained Word2Vec model
     elif method == "pretrained":
         assert path_to_w2v_bin_file is not None, "Optional parameter: 'path_to_w2v_bin_file' is required for method: 'pretrained'."
-        model = internal.w2v_pretrained(path_to_w2v_bin_file)
-        lambda_func = lambda sent: internal.get_vector_w2v(sent, model)
+        tokens = set(t for phrase in data.phrase for t in phrase) if w2v_vocab_subset else None
+        model = internal.w2v_pretrained(path_to_w2v_bin_file, tokens=tokens, cache_dir=w2v_cache_dir)
 
     # Generate a Word2Vec model from the input corpus and use it to create word vectors for each phrase
     elif method == "local":
-        assert doc_df is not None, "Optional parameter: 'doc_df' is required for method: 'local'."
-        large_sent_vec = list(doc_df.tokens)
-        model = models.Word2Vec(sg=1, window = 6, max_vocab_size = None, min_count=1, size=10, iter=500)
-        model.build_vocab(large_sent_vec)
-        model.train(large_sent_vec, total_examples=model.corpus_count, epochs=model.epochs)
-        lambda_func = lambda sent: internal.get_vector_w2v(sent, model)
+        assert doc_df is not None or (w2v_corpus_file is not None and os.path.exists(w2v_corpus_file)), \
+            "Optional parameter: 'doc_df' is required for method: 'local'."
+        large_sent_vec = list(doc_df.tokens) if doc_df is not None else None
+        model = internal.w2v_local(large_sent_vec, workers=w2v_workers, epochs=w2v_epochs, patience=w2v_patience,
+                                   cache_dir=w2v_cache_dir, corpus_file=w2v_corpus_file)
 
     # Invalid input paramter
     else:
         raise Exception(f"Unrecognized method: '{method}'")
 
-    # Create a word vector for each phrase and append it to the dataframe
-    vectors = data.apply(lambda_func, axis=1)
-    data['vec'] = vectors
+    # TF-IDF vectors sum each distinct token once, Word2Vec vectors sum every token that is in the model's vocabulary
+    phrases = list(data.phrase)
+    if method in ("pretrained", "local"):
+        term_vectors = model.wv.vectors
+        term_index = internal.get_w2v_term_index(model, set(t for phrase in phrases for t in phrase))
+    else:
+        term_index = dictionary.token2id
+    binary = method not in ("pretrained", "local")
+
+    # Create all phrase vectors at once as one float32 array and store a view of its rows in the dataframe
+    vectors = internal.get_phrase_vectors(phrases, term_vectors, term_index, binary).astype(np.float32, copy=False)
+    data['vec'] = list(vectors)
+
+    # Optionally return the term vectors with the index of each term
+    if return_term_vectors:
+        if method in ("pretrained", "local"):
+            term_index = internal.get_w2v_term_index(model)
+        return data, term_vectors, term_index
 
     return data
 
 # Cell
 def assign_clusters(data:DataFrame, method:str = "kmeans", dist_metric:str = "euclidean", k:int = None,
-                    height:int = None, show_chart:bool = False, show_dendrogram:bool = False):
+                    height:int = None, show_chart:bool = False, show_dendrogram:bool = False, k_search:str = "full",
+                    n_jobs:int = 1, sample_size:int = None, hac_mode:str = "square", n_neighbors:int = 15,
+                    kmeans_mode:str = "full", batch_size:int = 1024, chunk_size:int = None):
     """
     Clusters the sentences using phrase vectors.
 
     Options for `method` are ('kmeans', 'hac'). Options for `dist_metric` are ('cosine' or anything accepted by
     sklearn.metrics.pairwise_distances). `k` is the number of clusters for K-means clustering. `height` is the height
     at which the HAC dendrogram should be cut. When `show_chart` is True, the chart of silhoute scores by possible k or
-    height is shown inline. When `show_dendrogram` is True, the HAC dendrogram is shown inline.
-
-    Returns (DataFrame, np.ndarray, int, int)
+    height is shown inline. When `show_dendrogram` is True, the HAC dendrogram is shown inline. Options for `k_search`
+    are ('full', 'coarse', 'early_stop') and control which k-values are scored when `k` is not specified. `n_jobs` is
+    the number of processes used to score k-values or HAC heights. When `sample_size` is set, silhouette scores are
+    calculated on a random sample of that many phrases. Options for `hac_mode` are ('square', 'vectors', 'knn'); 'vectors' avoids the
+    n x n distance matrix and 'knn' restricts merges to the `n_neighbors` nearest neighbor graph for large phrase sets.
+    Options for `kmeans_mode` are ('full', 'minibatch'). 'minibatch' fits MiniBatchKMeans with batches of `batch_size`
+    phrases, streaming `chunk_size` phrases at a time through `partial_fit` when `chunk_size` is set.
+
+    The second value returned is the linkage matrix for HAC and the fitted K-means model for K-means, which can be
+    passed to `recluster` or `reassign_kmeans_clusters` to avoid refitting.
+
+    Returns (DataFrame, np.ndarray or KMeans, int, int)
     """
     max_thresh = len(data)
     linkage_matrix = None
 
     # Cluster using K-means algorithm
     if method == "kmeans":
-        cluster_assignments, cluster_thresh = internal.get_clusters_kmeans(data, k, show_chart = show_chart)
+        cluster_assignments, linkage_matrix, cluster_thresh = internal.get_clusters_kmeans(data, k, show_chart = show_chart,
+                                                        search = k_search, n_jobs = n_jobs, sample_size = sample_size,
+                                                        kmeans_mode = kmeans_mode, batch_size = batch_size,
+                                                        chunk_size = chunk_size)
 
     # Cluster using Hierarchical Agglomerative Clustering (HAC)
     elif method == "hac":
         cluster_assignments, linkage_matrix, max_thresh, cluster_thresh = internal.get_clusters_hac(data, dist_metric = dist_metric,
                                                         height = height, show_chart = show_chart,
-                                                        show_dendrogram = show_dendrogram)
+                                                        show_dendrogram = show_dendrogram, n_jobs = n_jobs,
+                                                        hac_mode = hac_mode, n_neighbors = n_neighbors,
+                                                        sample_size = sample_size)
 
     # Invalid input parameter
     else:
@@ -263,71 +482,58 @@ def reassign_hac_clusters(linkage_matrix:np.ndarray, height:int):
     """
     return internal.get_cluster_assignments_hac(linkage_matrix, height)
 
-def reassign_kmeans_clusters(phrase_vecs:list, k:int):
+def reassign_kmeans_clusters(phrase_vecs:list, k:int, kmeans_model:KMeans = None, kmeans_mode:str = "full",
+                             chunk_size:int = None):
     """
     Reassigns clusters using a different # of clusters.
+    `phrase_vecs` may also be the path to a .npy file, read `chunk_size` vectors at a time. When `kmeans_model` was
+    fitted with `k` clusters, it is reused instead of fitting a new model.
     """
-    return internal.get_cluster_assignments_kmeans(phrase_vecs, k)
+    return internal.get_cluster_assignments_kmeans(phrase_vecs, k, kmeans_model=kmeans_model, kmeans_mode=kmeans_mode,
+                                                   chunk_size=chunk_size)[0]
 
 # Cell
 def visualize_clustering(data:DataFrame, method:str = "umap", dist_metric:str = "cosine", umap_neighbors:int = 15,
                          show_chart = True, save_chart = False, return_data = False,
-                         chart_file = "output/cluster_visualization.html"):
+                         chart_file = "output/cluster_visualization.html", projection:str = "distance",
+                         landmarks:int = None, cache_dir:str = None, large_data:bool = False):
     """
     Visualize clustering in two dimensions.
 
     Options for `method` are ('umap', 'tsne', 'mds', 'svd'). Options for `dist_metric` are ('cosine' or anything accepted by
     sklearn.metrics.pairwise_distances). When `show_chart` is True, the visualization is shown inline.
     When `save_chart` is True, the visualization is saved to `chart_file`.
+    Options for `projection` are ('distance', 'vectors'). 'distance' projects the n x n matrix of distances between
+    phrases. 'vectors' projects the phrase vectors directly using `dist_metric`, which avoids that matrix for large
+    data. When `landmarks` is set, only that many sampled phrases are projected and the rest are placed around them.
+    When `cache_dir` is set, coordinates are cached there by a fingerprint of the phrase vectors and settings.
+    `large_data` is passed to `visualize_df`.
 
     Returns DataFrame
     """
 
-    # Calculate distances between all pairs of phrases
-    dist = pairwise_distances(list(data.vec), metric=dist_metric)
-
-    # Visualize the clusters using UMAP
-    if method == "umap":
-        reducer = umap.UMAP(n_neighbors=umap_neighbors, min_dist=.1, metric='cosine', random_state=42)
-        embedding = reducer.fit_transform(dist)
-        x, y = embedding[:, 0], embedding[:, 1]
+    # Project the phrases to two dimensions
+    phrase_vecs = internal.get_vector_matrix(data)
+    coords = internal.get_projection_cached(phrase_vecs, cache_dir, method=method, dist_metric=dist_metric,
+                                            umap_neighbors=umap_neighbors, projection=projection, landmarks=landmarks)
+    x, y = coords[:, 0], coords[:, 1]
 
-    elif method == "tsne":
-        vec = [list(x) for x in data.vec]
-        tsne2d = TSNE(n_components=2).fit_transform(vec)
-        x, y = tsne2d[:, 0], tsne2d[:, 1]
-
-    # Visualize the clusters using Multi-Dimensional Scaling (MDS)
-    elif method == "mds":
-        mds = MDS(n_components=2, dissimilarity="precomputed", random_state=42)
-        pos = mds.fit_transform(dist)
-        x, y = pos[:, 0], pos[:, 1]
-
-    # Visualize the clusters using Singular Value Decomposition (SVD)
-    elif method == "svd":
-        svd2d =  TruncatedSVD(n_components = 2, random_state = 42).fit_transform(dist)
-        x, y = svd2d[:, 0], svd2d[:, 1]
-
-    # Invalid input parameter
-    else:
-        raise Exception(f"Unrecognized method: '{method}'")
-
-    visualization_df = DataFrame(dict(label=list(data.id), cluster=list(data.cluster), phrase=list(data.phrase),
-                                      text=list(data.text), x=x, y=y))
     # To keep the visualization legible, limit
     max_phrase = 10
-    vis_df = visualization_df.copy()
-    vis_df.phrase = vis_df.apply(lambda x: x.phrase[:max_phrase] + ['...'] if len(x.phrase)>max_phrase else x.phrase, axis=1)
+    phrases = [phrase[:max_phrase] + ['...'] if len(phrase)>max_phrase else phrase for phrase in data.phrase]
+    vis_df = DataFrame(dict(label=list(data.id), cluster=list(data.cluster), phrase=phrases, text=list(data.text),
+                            x=x, y=y))
 
     # Produce visualization
-    visualize_df(vis_df, show_chart=show_chart, save_chart=save_chart, chart_file=chart_file)
+    visualize_df(vis_df, show_chart=show_chart, save_chart=save_chart, chart_file=chart_file, large_data=large_data)
 
     # Return the data to display clusters
     if return_data:
         return vis_df
 
 def visualize_df(vis_df:DataFrame, cluster_df:DataFrame=None, show_chart = True, save_chart = False, min_cluster_size = 0,
-                 chart_file = "output/cluster_visualization.html"):
+                 chart_file = "output/cluster_visualization.html", large_data:bool = False, max_points:int = 100000,
+                 max_hover_chars:int = 80):
     """
     Visualize clustering in two dimensions. This method takes in the vis_df produced by visualize_clustering.
     The cluster column can be updated to dynamically try different clustering thresholds without the overhead of
@@ -336,7 +542,13 @@ def visualize_df(vis_df:DataFrame, cluster_df:DataFrame=None, show_chart = True,
     `min_cluster_size` is the minimum # of points for a cluster to be displayed.
     When `show_chart` is True, the visualization is shown inline.
     When `save_chart` is True, the visualization is saved to `chart_file`.
+    When `large_data` is True, the chart is rendered with WebGL from float32 coordinates, at most `max_points` points
+    are drawn (sampled per cluster so every cluster keeps at least one point), hover phrases are truncated to
+    `max_hover_chars` characters and saved charts load plotly.js from a CDN instead of embedding it.
     """
+    import plotly
+    import plotly.express as px
+
     if min_cluster_size > 0 and cluster_df is not None:
         # List of "valid" clusters containing the min_cluster_size points
         valid = list(cluster_df[cluster_df.sent_count >= min_cluster_size].cluster)
@@ -344,8 +556,20 @@ def visualize_df(vis_df:DataFrame, cluster_df:DataFrame=None, show_chart = True,
         valid = list(vis_df.cluster)
 
     # Only display clusters containing the min_cluster_size points
-    fig = px.scatter(vis_df[vis_df.cluster.isin(valid)], x="x", y="y", hover_name="label", color="cluster",
-                     hover_data=["phrase","cluster"], color_continuous_scale='rainbow')
+    plot_df = vis_df[vis_df.cluster.isin(valid)]
+    render_args = {}
+
+    # Optionally downsample and shrink the data for large charts
+    if large_data:
+        plot_df = internal.downsample_clusters(plot_df, max_points)
+        phrases = [" ".join(map(str, phrase)) for phrase in plot_df.phrase]
+        plot_df = plot_df.assign(x=plot_df.x.astype(np.float32), y=plot_df.y.astype(np.float32),
+                                 phrase=[p[:max_hover_chars] + '...' if len(p) > max_hover_chars else p
+                                         for p in phrases])
+        render_args = dict(render_mode='webgl')
+
+    fig = px.scatter(plot_df, x="x", y="y", hover_name="label", color="cluster",
+                     hover_data=["phrase","cluster"], color_continuous_scale='rainbow', **render_args)
 
     # Print visualization to screen by default
     if show_chart:
@@ -356,48 +580,58 @@ def visualize_df(vis_df:DataFrame, cluster_df:DataFrame=None, show_chart = True,
         # Create the output directory if it doesn't exist
         os.makedirs(os.path.dirname(chart_file), exist_ok=True)
 
-        plotly.offline.plot(fig, filename=chart_file)
+        plotly.offline.plot(fig, filename=chart_file, include_plotlyjs='cdn' if large_data else True)
 
 # Cell
 def get_cluster_topics(data:DataFrame, doc_df:DataFrame = None, topics_per_cluster:int = 10, save_results:bool = False,
-                       file_name:str = 'output/TopicClusterResults.txt'):
+                       file_name:str = 'output/TopicClusterResults.txt', method:str = "ctfidf", n_jobs:int = 1,
+                       output_format:str = "txt", topic_cache:dict = None):
     """
     Gets the main topics for each cluster.
 
     `topics_per_cluster` is the number of main topics per cluster. When `save_results` is True, the resulting dataframe
-    will be saved to `file_name`.
+    will be saved to `file_name`. Options for `method` are ('ctfidf', 'lda'). 'ctfidf' ranks the terms of all clusters
+    at once by class-based TF-IDF. 'lda' fits a one-topic LDA model per cluster on `n_jobs` processes. Options for
+    `output_format` are ('txt', 'parquet', 'jsonl'). When `topic_cache` is a dict, results are stored in it and reused
+    by later calls on the same data (see `recluster`).
 
     Returns DataFrame
     """
 
-    # Iterate distinct clusters
-    rows = []
-    for c in set(data.cluster):
-        cluster_tokens = [t for t in data[data.cluster == c].tokens]
-        topics = internal.get_topics_from_docs(cluster_tokens, topics_per_cluster)
-        rows.append(Series([c, topics, len(cluster_tokens)], index=["cluster", "topics", "sent_count"]))
-
-    cluster_df = DataFrame(rows)
+    # Get the topics of all clusters at once
+    if topic_cache is not None:
+        topics = internal.get_group_topics_cached(list(data.tokens), data.cluster.to_numpy(), topics_per_cluster,
+                                                  topic_cache, method, n_jobs, doc_ids=list(data.id))
+    else:
+        topics = internal.get_group_topics(list(data.tokens), data.cluster.to_numpy(), topics_per_cluster, method,
+                                           n_jobs)
+    sent_counts = data.cluster.value_counts()
+    cluster_df = DataFrame(dict(cluster=topics.index, topics=list(topics),
+                                sent_count=sent_counts[topics.index].to_numpy()))
 
     # Optionally save clusters to disk
     if save_results:
         assert doc_df is not None, "Optional parameter: 'doc_df' is required when save_results = True."
-        internal.clusters_to_disk(data, doc_df, cluster_df, file_name)
+        internal.clusters_to_disk(data, doc_df, cluster_df, file_name, output_format)
 
     return cluster_df
 
 # Cell
 def recluster(data:DataFrame, viz_df:DataFrame, cluster_method:str,
               linkage_matrix:np.ndarray=None, height:int=None, k:int=None, min_cluster_size:int=None,
-              topics_per_cluster:int=10, show_chart = True):
+              topics_per_cluster:int=10, show_chart = True, kmeans_model:KMeans=None, method:str = "ctfidf",
+              n_jobs:int = 1, topic_cache:dict = None):
     """
     Recomputes clusters with a new threshold using the output of a previous clustering.
+    Pass the K-means model returned by `assign_clusters` as `kmeans_model` to reuse it when `k` is unchanged.
+    `method` and `n_jobs` are passed to `get_cluster_topics`. Pass the same dict as `topic_cache` on repeated calls to
+    reuse the topics of clusters whose members did not change.
 
     Returns DataFrame, DataFrame
     """
     # Assign new clusters
     if cluster_method == 'kmeans':
-        viz_df.cluster = reassign_kmeans_clusters(list(data.vec),k=k)
+        viz_df.cluster = reassign_kmeans_clusters(internal.get_vector_matrix(data),k=k,kmeans_model=kmeans_model)
     elif cluster_method == 'hac':
         viz_df.cluster = reassign_hac_clusters(linkage_matrix,height=height)
     else:
@@ -407,7 +641,8 @@ def recluster(data:DataFrame, viz_df:DataFrame, cluster_method:str,
     data.cluster = viz_df.cluster
 
     # Compute cluster_df
-    cluster_df = get_cluster_topics(data, topics_per_cluster=topics_per_cluster, save_results=False)
+    cluster_df = get_cluster_topics(data, topics_per_cluster=topics_per_cluster, save_results=False, method=method,
+                                    n_jobs=n_jobs, topic_cache=topic_cache)
 
     if show_chart == True:
         visualize_df(viz_df, cluster_df, min_cluster_size=min_cluster_size, show_chart=show_chart)
@@ -421,18 +656,148 @@ def recluster(data:DataFrame, viz_df:DataFrame, cluster_method:str,
 
     return data, cluster_df
 
+# Cell
+class TopExModel():
+    """
+    A fitted TopEx pipeline that assigns new sentences to existing clusters without refitting.
+
+    Wraps the vocabulary and max token scores from `create_tfidf`, the term vectors from `get_vectors` and the cluster
+    centroids from `assign_clusters`. New sentences have no column in the TF-IDF matrix, so their phrases are always
+    scored with the max token scores (as with tfidf_corpus='expansion'). Use `save` and `TopExModel.load` to persist
+    the model as a directory of .npy files, which are memory-mapped when loaded.
+    """
+    def __init__(self, vocab:dict, max_token_scores:np.ndarray, term_vectors:np.ndarray, term_index:dict,
+                 centroids:np.ndarray, cluster_ids:np.ndarray, vector_method:str = "tfidf", window_size:int = 6,
+                 include_sentiment:bool = True, sentiment_mode:str = "exact"):
+        self.vocab = vocab
+        self.max_token_scores = max_token_scores
+        self.term_vectors = term_vectors
+        self.term_index = term_index
+        self.centroids = centroids
+        self.cluster_ids = cluster_ids
+        self.vector_method = vector_method
+        self.window_size = window_size
+        self.include_sentiment = include_sentiment
+        self.sentiment_mode = sentiment_mode
+
+    @classmethod
+    def from_clustering(cls, data:DataFrame, dictionary:gensim.corpora.dictionary.Dictionary, tfidf:np.ndarray,
+                        term_vectors:np.ndarray, term_index:dict, vector_method:str = "tfidf", window_size:int = 6,
+                        include_sentiment:bool = True, sentiment_mode:str = "exact", kmeans_model:KMeans = None):
+        """
+        Creates a model from the output of a clustering run. `term_vectors` and `term_index` are returned by
+        `get_vectors` with `return_term_vectors=True`. The centroids of a fitted `kmeans_model` are used when passed,
+        otherwise each cluster in `data` (e.g. from HAC) is represented by the mean of its phrase vectors.
+        Word2Vec term vectors are limited to the terms of the TF-IDF vocabulary (the tokens in `data` for a hashed
+        vocabulary), so that the model doesn't carry a whole pretrained embedding table.
+
+        Returns TopExModel
+        """
+        if vector_method in ("pretrained", "local"):
+            vocab = dictionary.token2id
+            tokens = (set(t for tokens in data.tokens for t in tokens) if isinstance(vocab, internal.HashedVocab)
+                      else vocab.keys())
+            term_vectors, term_index = internal.get_term_subset(term_vectors, term_index, tokens)
+
+        if kmeans_model is not None:
+            centroids, cluster_ids = kmeans_model.cluster_centers_, np.arange(kmeans_model.n_clusters)
+        else:
+            vecs = DataFrame(internal.get_vector_matrix(data))
+            means = vecs.groupby(data.cluster.to_numpy()).mean()
+            centroids, cluster_ids = means.to_numpy(), means.index.to_numpy()
+        return cls(dictionary.token2id, internal.get_max_token_scores(tfidf), term_vectors, term_index, centroids,
+                   cluster_ids, vector_method, window_size, include_sentiment, sentiment_mode)
+
+    def transform(self, data:DataFrame):
+        """
+        Extracts the most expressive phrase from each sentence in `data` (as returned by `import_data`) and creates its
+        vector. Sentences shorter than `window_size` are removed.
+
+        Returns DataFrame
+        """
+        if self.window_size > 0:
+            filtered_df = data[data.tokens.map(len)>=self.window_size].copy().reset_index(drop=True)
+            filtered_df['phrase'] = internal.get_phrases_batch(filtered_df, self.window_size, self.vocab, 'expansion',
+                                                               None, self.max_token_scores, self.include_sentiment,
+                                                               sentiment_mode=self.sentiment_mode)
+        else:
+            filtered_df = data.copy().reset_index(drop=True)
+            filtered_df['phrase'] = filtered_df.tokens
+
+        # TF-IDF based vectors count each token once, Word2Vec vectors count every occurrence
+        binary = self.vector_method not in ("pretrained", "local")
+        vectors = internal.get_phrase_vectors(list(filtered_df.phrase), self.term_vectors, self.term_index, binary)
+        filtered_df['vec'] = list(vectors)
+        return filtered_df
+
+    def predict(self, data:DataFrame):
+        """
+        Assigns each sentence in `data` to the cluster with the nearest centroid.
+
+        Returns DataFrame
+        """
+        transformed_df = self.transform(data)
+        if len(transformed_df) > 0:
+            nearest = pairwise_distances_argmin(np.array(list(transformed_df.vec)), self.centroids)
+            transformed_df['cluster'] = np.asarray(self.cluster_ids)[nearest]
+        else:
+            transformed_df['cluster'] = []
+        return transformed_df
+
+    def save(self, path:str):
+        """
+        Saves the model to the directory `path`.
+        """
+        os.makedirs(path, exist_ok=True)
+        meta = dict(vocab=internal.get_index_meta(self.vocab), terms=internal.get_index_meta(self.term_index),
+                    vector_method=self.vector_method, window_size=self.window_size,
+                    include_sentiment=self.include_sentiment, sentiment_mode=self.sentiment_mode)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        np.save(os.path.join(path, 'max_token_scores.npy'), self.max_token_scores)
+        np.save(os.path.join(path, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'cluster_ids.npy'), self.cluster_ids)
+        if scipy.sparse.issparse(self.term_vectors):
+            scipy.sparse.save_npz(os.path.join(path, 'term_vectors.npz'), self.term_vectors.tocsr())
+        else:
+            np.save(os.path.join(path, 'term_vectors.npy'), self.term_vectors)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        """
+        Loads a model saved with `save`. When `mmap` is True, arrays are memory-mapped instead of read into memory.
+
+        Returns TopExModel
+        """
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+        if os.path.exists(os.path.join(path, 'term_vectors.npz')):
+            term_vectors = scipy.sparse.load_npz(os.path.join(path, 'term_vectors.npz'))
+        else:
+            term_vectors = load('term_vectors.npy')
+        vocab = internal.load_index_meta(meta['vocab'])
+        term_index = internal.load_index_meta(meta['terms'])
+        return cls(vocab, load('max_token_scores.npy'), term_vectors, term_index, load('centroids.npy'),
+                   load('cluster_ids.npy'), meta['vector_method'], meta['window_size'], meta['include_sentiment'],
+                   meta['sentiment_mode'])
+
 # Cell
 def get_doc_topics(doc_df:DataFrame, topics_per_doc:int = 10, save_results:bool = False,
-                       file_name:str = 'output/TopicDocumentResults.txt'):
+                       file_name:str = 'output/TopicDocumentResults.txt', method:str = "ctfidf", n_jobs:int = 1):
     """
     Gets the main topics for each document.
 
     `topics_per_doc` is the number of topics extracted per document. When `save_results` is True, the resulting dataframe
-    will be saved to `file_name`.
+    will be saved to `file_name`. Options for `method` are ('ctfidf', 'lda'), see `get_cluster_topics`.
 
     Returns DataFrame
     """
-    doc_df['topics'] = [internal.get_topics_from_docs([doc], topics_per_doc) for doc in doc_df.tokens]
+    topics = internal.get_group_topics(list(doc_df.tokens), np.arange(len(doc_df)), topics_per_doc, method, n_jobs)
+    doc_df['topics'] = list(topics)
 
     # Optionally save clusters to disk
     if save_results:
@@ -441,14 +806,16 @@ def get_doc_topics(doc_df:DataFrame, topics_per_doc:int = 10, save_results:bool
     return doc_df
 
 # Cell
-def evaluate(data, gold_file, save_results = False, file_name = "output/EvaluationResults.txt"):
+def evaluate(data, gold_file, save_results = False, file_name = "output/EvaluationResults.txt",
+             return_metrics = False):
     """
     Evaluate precision, recall, and F1 against a gold standard dataset.
 
     `gold_file` is a path to a text file containing a list IDs and labels. When `save_results` is True, the resulting
-    dataframe will be saved to `file_name`.
+    dataframe will be saved to `file_name`. When `return_metrics` is True, overall clustering metrics (purity, ARI, NMI
+    and B-cubed precision, recall and F1) for the sentences in both the gold standard and `data` are also returned.
 
-    Returns DataFrame
+    Returns DataFrame or (DataFrame, Series)
     """
 
     # Import gold standard list of IDs (doc.#.sent.#) and labels
@@ -456,37 +823,178 @@ def evaluate(data, gold_file, save_results = False, file_name = "output/Evaluati
 
     # Inner join the actual labels with the assigned clusters for each document.
     eval_df = pd.merge(gold_df, data[["id", "cluster"]], on="id")
+    labels = sorted(set(gold_df.label))
 
-    # Iterate labels in the gold standard dataset
-    rows = []
-    for label in set(gold_df.label):
-        cluster_rows = eval_df[eval_df.label == label]
+    # Label x cluster contingency matrices counting joined rows (to find the closest cluster) and distinct IDs
+    clusters = np.sort(eval_df.cluster.unique())
+    row_counts = internal.get_contingency_matrix(eval_df.label, eval_df.cluster, labels, clusters)
+    distinct_df = eval_df.drop_duplicates(["id", "label"])
+    id_counts = internal.get_contingency_matrix(distinct_df.label, distinct_df.cluster, labels, clusters)
 
-        # Find the cluster with the most instances of each label in the gold standard dataset
-        closest_cluster = cluster_rows.cluster.mode()[0] if len(cluster_rows) > 0 else -1
+    # Find the cluster with the most instances of each label in the gold standard dataset
+    closest_ix = row_counts.argmax(axis=1) if len(clusters) > 0 else np.zeros(len(labels), dtype=int)
+    has_rows = row_counts.sum(axis=1) > 0
 
-        # IDs assigned to a label in the gold standard dataset
-        gold_examples = set(gold_df[gold_df.label == label].id)
+    # IDs assigned to each label in the gold standard dataset and IDs in each cluster
+    gold_examples = gold_df.groupby("label").id.agg(set)
+    cluster_members = eval_df.groupby("cluster").id.agg(set)
+    gold_sizes = gold_examples.map(len)
+    cluster_sizes = cluster_members.map(len)
 
-        # IDs in the closest cluster
-        closest_cluster_members = set(eval_df[eval_df.cluster == closest_cluster].id)
+    rows = []
+    for i, label in enumerate(labels):
+        closest_cluster = clusters[closest_ix[i]] if has_rows[i] else -1
+        closest_cluster_members = cluster_members.get(closest_cluster, set())
 
         # Calculate performance metrics
-        tp = len(gold_examples.intersection(closest_cluster_members))
-        fp = len(closest_cluster_members - gold_examples)
-        fn = len(gold_examples - closest_cluster_members)
+        tp = int(id_counts[i, closest_ix[i]]) if has_rows[i] else 0
+        fp = int(cluster_sizes.get(closest_cluster, 0)) - tp
+        fn = int(gold_sizes[label]) - tp
         precision = round(tp/(tp+fp), 3) if (tp+fp) > 0 else float("Nan")
         recall = round(tp/(tp+fn), 3) if (tp+fn) > 0 else float("Nan")
         f1 = round(2*((precision*recall)/(precision+recall)), 3) if (precision+recall) > 0 else float("Nan")
 
-        rows.append(Series([label, gold_examples, closest_cluster, closest_cluster_members, tp, fp, fn, precision, recall, f1],
-                              index=["label", "gold_examples", "closest_cluster", "closest_cluster_members", "tp", "fp", "fn", "precision", "recall", "f1"]))
+        rows.append((label, gold_examples[label], closest_cluster, closest_cluster_members, tp, fp, fn, precision,
+                     recall, f1))
 
     # Create results dataframe with a row for each label
-    results_df = DataFrame(rows).sort_values(by=["label"])
+    results_df = DataFrame(rows, columns=["label", "gold_examples", "closest_cluster", "closest_cluster_members", "tp",
+                                          "fp", "fn", "precision", "recall", "f1"]).sort_values(by=["label"])
 
     # Optionally save the results to disk
     if save_results:
         internal.df_to_disk(results_df, file_name)
 
-    return results_df
\ No newline at end of file
+    # Optionally calculate clustering metrics over the distinct IDs in both the gold standard and the data
+    if return_metrics:
+        first_labels = eval_df.drop_duplicates("id")
+        contingency = internal.get_contingency_matrix(first_labels.label, first_labels.cluster, labels, clusters)
+        metrics = internal.get_contingency_metrics(contingency[contingency.sum(axis=1) > 0])
+        return results_df, metrics
+
+    return results_df
+
+# Cell
+def sweep_clusters(ids:np.ndarray, phrase_vecs:np.ndarray, gold_file:str, cluster_method:str, thresholds:list,
+                   cluster_args:dict = None):
+    """
+    Clusters the phrase vectors for each k (K-means) or height (HAC) in `thresholds` and evaluates each clustering.
+    HAC builds the linkage matrix once and cuts it at every height. Called by `sweep`, usually in a worker process.
+
+    Returns list of dict
+    """
+    data = DataFrame(dict(id=ids, vec=list(phrase_vecs)))
+    cluster_args = cluster_args or {}
+    linkage_matrix, max_h, results = None, None, []
+    for threshold in thresholds:
+        start = time.perf_counter()
+
+        # Reuse the HAC tree for every height after the first
+        if linkage_matrix is not None:
+            if threshold is None:
+                threshold = internal.get_optimal_height(data, linkage_matrix, max_h, show_chart=False)
+            data['cluster'] = reassign_hac_clusters(linkage_matrix, threshold)
+        else:
+            threshold_arg = dict(k=threshold) if cluster_method == "kmeans" else dict(height=threshold)
+            data, model, max_h, threshold = assign_clusters(data, method=cluster_method, **threshold_arg,
+                                                            **cluster_args)
+            if cluster_method == "hac":
+                linkage_matrix = model
+        cluster_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results_df, metrics = evaluate(data, gold_file, return_metrics=True)
+        results.append(dict(threshold=threshold, clusters=data.cluster.nunique(), macro_f1=results_df.f1.mean(),
+                            **metrics, cluster_seconds=cluster_seconds,
+                            evaluate_seconds=time.perf_counter() - start))
+    return results
+
+def sweep(data:DataFrame, doc_df:DataFrame, gold_file:str, param_grid:dict, tfidf_corpus:str = 'clustering',
+          n_jobs:int = 1, tfidf_args:dict = None, phrase_args:dict = None, vector_args:dict = None,
+          cluster_args:dict = None):
+    """
+    Runs `create_tfidf`, `get_phrases`, `get_vectors`, `assign_clusters` and `evaluate` for every combination of
+    parameters in `param_grid` and returns a table of metrics and timings with a row per configuration.
+
+    `param_grid` maps any of ('window_size', 'vector_method', 'dimensions', 'cluster_method', 'k', 'height') to a list
+    of values; missing parameters use the defaults of the functions above. `k` only applies to K-means, `height` only
+    to HAC and `dimensions` only to the 'svd' and 'umap' vector methods. A `k` or `height` of None is chosen by
+    silhouette score. `tfidf_args`, `phrase_args`, `vector_args` and `cluster_args` are extra arguments for
+    `create_tfidf`, `get_phrases`, `get_vectors` and `assign_clusters`. `tfidf_args` must give the expansion corpus
+    (e.g. `path_to_expansion_csv` or `expansion_stats_dir`) when `tfidf_corpus` is 'both' or 'expansion'.
+
+    Each stage is computed once per distinct value of the parameters it depends on: the TF-IDF matrix once, phrases
+    once per window size, phrase vectors once per (window size, vector method, dimensions) and the HAC tree once per
+    set of phrase vectors. Clustering and evaluation run on `n_jobs` processes. The seconds reported for shared stages
+    are the time the stage took once, not a share of it. The `k` and `height` columns hold the value that was used,
+    including those chosen by silhouette score.
+
+    Returns DataFrame
+    """
+    defaults = dict(window_size=[6], vector_method=['svd'], dimensions=[2], cluster_method=['kmeans'], k=[None],
+                    height=[None])
+    unknown = set(param_grid) - set(defaults)
+    if unknown:
+        raise Exception(f"Unrecognized parameters: {sorted(unknown)}")
+    grid = dict(defaults, **param_grid)
+
+    # Expand the grid, ignoring parameters that do not apply to a configuration
+    configs = []
+    for values in itertools.product(*grid.values()):
+        config = dict(zip(grid.keys(), values))
+        if config['vector_method'] not in ('svd', 'umap'):
+            config['dimensions'] = None
+        if config['cluster_method'] == 'hac':
+            config['k'] = None
+        else:
+            config['height'] = None
+        if config not in configs:
+            configs.append(config)
+
+    # TF-IDF is shared by every configuration
+    start = time.perf_counter()
+    tfidf, dictionary = create_tfidf(tfidf_corpus, doc_df, **(tfidf_args or {}))
+    tfidf_seconds = time.perf_counter() - start
+
+    # Memoize phrases by window size and phrase vectors by (window size, vector method, dimensions)
+    phrases, vectors, timings = {}, {}, {}
+    for config in configs:
+        window_size, vector_key = config['window_size'], (config['window_size'], config['vector_method'],
+                                                          config['dimensions'])
+        if window_size not in phrases:
+            start = time.perf_counter()
+            phrases[window_size] = get_phrases(data, dictionary.token2id, tfidf, window_size=window_size,
+                                               tfidf_corpus=tfidf_corpus, **(phrase_args or {}))
+            timings[window_size] = time.perf_counter() - start
+        if vector_key not in vectors:
+            start = time.perf_counter()
+            dimension_arg = dict(dimensions=config['dimensions']) if config['dimensions'] is not None else {}
+            vector_df = get_vectors(config['vector_method'], phrases[window_size].copy(), dictionary=dictionary,
+                                    tfidf=tfidf, doc_df=doc_df, **dimension_arg, **(vector_args or {}))
+            vectors[vector_key] = (vector_df.id.to_numpy(), internal.get_vector_matrix(vector_df))
+            timings[vector_key] = time.perf_counter() - start
+
+    # One clustering job per K-means configuration and per HAC tree, which is cut at each of its heights
+    jobs = {}
+    for config in configs:
+        vector_key = (config['window_size'], config['vector_method'], config['dimensions'])
+        if config['cluster_method'] == 'hac':
+            jobs.setdefault(vector_key + ('hac',), []).append(config)
+        else:
+            jobs[vector_key + (config['cluster_method'], config['k'])] = [config]
+    job_results = Parallel(n_jobs=n_jobs)(
+        delayed(sweep_clusters)(*vectors[job_key[:3]], gold_file, job_configs[0]['cluster_method'],
+                                [c['k'] if c['cluster_method'] != 'hac' else c['height'] for c in job_configs],
+                                cluster_args)
+        for job_key, job_configs in jobs.items())
+
+    # Combine the parameters, metrics and timings of each configuration
+    rows = []
+    for (job_key, job_configs), results in zip(jobs.items(), job_results):
+        for config, result in zip(job_configs, results):
+            threshold = result.pop('threshold')
+            row = dict(config, **{'k' if config['cluster_method'] != 'hac' else 'height': threshold})
+            row.update(result, tfidf_seconds=tfidf_seconds, phrase_seconds=timings[config['window_size']],
+                       vector_seconds=timings[job_key[:3]])
+            rows.append(row)
+    return DataFrame(rows)
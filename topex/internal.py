@@ -1,26 +1,45 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: internal.ipynb (unless otherwise specified).
 
-__all__ = ['score_phrase', 'score_token', 'get_phrase', 'get_vector_tfidf', 'get_vector_w2v', 'w2v_pretrained',
-           'get_cluster_assignments_hac', 'get_silhouette_score_hac', 'get_tree_height', 'get_optimal_height',
-           'get_clusters_hac', 'get_silhouette_score_kmeans', 'get_optimal_k', 'get_cluster_assignments_kmeans',
-           'get_clusters_kmeans', 'get_topics_from_docs', 'df_to_disk', 'sentences_to_disk', 'write_cluster',
-           'clusters_to_disk']
+__all__ = ['score_phrase', 'get_polarity', 'get_sentiment_lexicon', 'score_token', 'get_phrase', 'get_max_token_scores',
+           'get_token_scores', 'get_window_scores', 'get_window_polarity', 'get_phrases_batch', 'get_vector_tfidf',
+           'get_vector_w2v', 'get_w2v_term_index', 'get_term_subset', 'get_phrase_term_matrix', 'get_phrase_vectors',
+           'get_vector_matrix', 'w2v_pretrained', 'get_w2v_native_file', 'load_w2v_native', 'get_w2v_subset',
+           'w2v_local', 'get_w2v_fingerprint', 'get_cluster_assignments_hac', 'get_silhouette_score_hac',
+           'get_tree_height', 'get_height_scores', 'get_optimal_height', 'get_linkage_knn', 'get_linkage_matrix',
+           'get_clusters_hac', 'get_silhouette_score_kmeans', 'get_silhouette_score_labels', 'score_k_chain',
+           'get_k_scores', 'get_optimal_k', 'iter_vector_chunks', 'fit_kmeans', 'predict_kmeans',
+           'get_cluster_assignments_kmeans', 'get_clusters_kmeans', 'get_topics_from_docs', 'get_term_counts',
+           'get_topics_ctfidf', 'get_group_topics', 'get_group_topics_cached', 'df_to_disk', 'sentences_to_disk',
+           'write_cluster', 'clusters_to_disk', 'get_contingency_matrix', 'get_contingency_metrics', 'fit_projection',
+           'place_by_neighbors', 'get_projection', 'get_projection_cached', 'downsample_clusters', 'get_count_matrix',
+           'get_tfidf_matrix', 'get_source_fingerprint', 'save_corpus_stats', 'load_corpus_stats', 'merge_corpus_stats',
+           'HashedVocab', 'get_hash_dictionary', 'get_index_meta', 'load_index_meta', 'tokens_to_disk',
+           'iter_token_file', 'get_kept_terms', 'get_tfidf_matrix_streaming', 'load_sparse_matrix']
 
 # Cell
 import csv
+from functools import lru_cache
 import gensim
 from gensim import corpora, models
+import hashlib
+import json
+from joblib import Parallel, delayed, effective_n_jobs
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
 from pandas import DataFrame, Series
-from scipy.cluster import hierarchy
-from scipy.cluster.hierarchy import ward, cut_tree, dendrogram
-from sklearn.cluster import KMeans
+from scipy import sparse
+from scipy.cluster.hierarchy import ward, cut_tree, dendrogram, linkage
+from scipy.spatial.distance import pdist
+from sklearn.cluster import AgglomerativeClustering, KMeans, MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
 from sklearn.metrics import silhouette_score, pairwise_distances
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.neighbors import kneighbors_graph, NearestNeighbors
+from sklearn.preprocessing import normalize
 from textblob import TextBlob
+from textblob.en import sentiment as pattern_sentiment
 
 # Cell
 def score_phrase(phrase:list, score:float, include_sentiment:bool):
@@ -32,10 +51,29 @@ def score_phrase(phrase:list, score:float, include_sentiment:bool):
 
     # Optionally weight the polarity of the phrase
     if include_sentiment:
-        weight += abs(TextBlob(" ".join(phrase)).sentiment.polarity)
+        weight += abs(get_polarity(" ".join(phrase)))
 
     return score * weight
 
+@lru_cache(maxsize=2**18)
+def get_polarity(text:str):
+    """
+    Gets the TextBlob polarity of a string. Results are cached since the same windows recur across sentences and runs.
+
+    Returns float
+    """
+    return TextBlob(text).sentiment.polarity
+
+@lru_cache(maxsize=None)
+def get_sentiment_lexicon():
+    """
+    Gets the polarity of every word in TextBlob's pattern lexicon, averaged across parts of speech.
+    The lexicon is only loaded once.
+
+    Returns dict
+    """
+    return {word: scores[None][0] for word, scores in pattern_sentiment.items()}
+
 def score_token(token:str, pos:str, doc_id:int, vocab:dict, tfidf:np.ndarray, max_token_scores:np.ndarray,
                 tfidf_corpus:str, include_sentiment:bool):
     """
@@ -82,16 +120,148 @@ def get_phrase(sent:Series, window_size:int, vocab:dict, tfidf_corpus:str, tfidf
 
     return phrase
 
+def get_max_token_scores(tfidf):
+    """
+    Gets the maximum score of each token (row) across all documents in a dense or sparse TF-IDF matrix.
+
+    Returns np.ndarray
+    """
+    if sparse.issparse(tfidf):
+        return tfidf.max(axis=1).toarray().ravel()
+    return np.max(tfidf, axis=1)
+
+# Cell
+def get_token_scores(tokens:list, pos_tags:list, doc_ids:np.ndarray, vocab:dict, tfidf_corpus:str, tfidf:np.ndarray,
+                     max_token_scores:np.ndarray, include_sentiment:bool):
+    """
+    Scores a flat list of tokens at once. Equivalent to calling `score_token` on each token, but vocabulary lookups
+    happen once per token and scores are gathered from the TF-IDF matrix with NumPy fancy indexing.
+
+    Returns np.ndarray
+    """
+    token_ids = pd.Series(tokens, dtype=object).map(vocab)
+    in_vocab = token_ids.notna().to_numpy()
+    token_ix = token_ids[in_vocab].to_numpy(dtype=np.int64)
+
+    # Token score comes from TF-IDf matrix if tfidf_corpus='clustering' is set, otherwise, use max token score
+    scores = np.zeros(len(tokens), dtype=max_token_scores.dtype)
+    if tfidf_corpus == 'clustering':
+        scores[in_vocab] = np.asarray(tfidf[token_ix, doc_ids[in_vocab]]).ravel()
+    else:
+        scores[in_vocab] = max_token_scores[token_ix]
+
+    # Scale token_score by 3x if including sentiment and the token is an adjective or adverb
+    if include_sentiment:
+        scores = scores.astype(type(scores.dtype.type(0) * 3))
+        scores[np.isin(np.asarray(pos_tags, dtype=object), ['ADJ', 'ADV'])] *= 3
+
+    return scores
+
+def get_window_scores(token_scores:np.ndarray, window_starts:np.ndarray, window_size:int):
+    """
+    Sums the token scores of every sliding window starting at `window_starts`.
+
+    Tokens are added one position at a time, in the same order and at the same precision as `sum()` in `get_phrase`,
+    so window scores (and therefore ties between windows) match the row-by-row implementation exactly.
+
+    Returns np.ndarray
+    """
+    # Mirror the dtype Python's sum() would produce for these scores under the installed version of NumPy
+    score_type = token_scores.dtype.type
+    sum_type = type(0 + score_type(0))
+    sum_type = type(sum_type(0) + score_type(0))
+
+    window_scores = np.zeros(len(window_starts), dtype=sum_type)
+    for i in range(window_size):
+        window_scores += token_scores[window_starts + i]
+
+    return window_scores
+
+def get_window_polarity(tokens:list, window_starts:np.ndarray, window_size:int):
+    """
+    Approximates the TextBlob polarity of every sliding window starting at `window_starts` as the average polarity
+    of the window's tokens found in the pattern lexicon. Token polarities are looked up once and windows are scored
+    incrementally from running sums. Unlike TextBlob, modifiers ("very good") and negations ("not good") are ignored.
+
+    Returns np.ndarray
+    """
+    polarity = pd.Series(tokens, dtype=object).map(get_sentiment_lexicon())
+    known = polarity.notna().to_numpy()
+    polarity = polarity.fillna(0).to_numpy(dtype=float)
+
+    # Running sums of polarity and lexicon hits let each window be scored as the difference of two sums
+    polarity_sums = np.concatenate(([0], np.cumsum(polarity)))
+    known_sums = np.concatenate(([0], np.cumsum(known)))
+    window_polarity = polarity_sums[window_starts + window_size] - polarity_sums[window_starts]
+    window_known = known_sums[window_starts + window_size] - known_sums[window_starts]
+
+    return window_polarity / np.maximum(window_known, 1)
+
+def get_phrases_batch(data:DataFrame, window_size:int, vocab:dict, tfidf_corpus:str, tfidf:np.ndarray,
+                      max_token_scores:np.ndarray, include_sentiment:bool, batch_size:int=100000,
+                      sentiment_mode:str='exact'):
+    """
+    Finds the most expressive phrase in every sentence of `data`. This is a batched equivalent of applying
+    `get_phrase` to each row: all tokens in a batch are scored at once, every sliding window is scored with
+    array operations and the best window in each sentence is found with a segmented argmax. Every sentence must
+    contain at least `window_size` tokens. `batch_size` is the number of sentences processed at a time.
+
+    Options for `sentiment_mode` are ('exact', 'fast'). 'exact' scores each window with (cached) TextBlob polarity.
+    'fast' uses `get_window_polarity`, which may pick different phrases in sentences with modifiers or negations.
+
+    Returns list
+    """
+    phrases = []
+    for batch_start in range(0, len(data), batch_size):
+        batch = data.iloc[batch_start:batch_start + batch_size]
+        sent_tokens = list(batch.tokens)
+
+        # Flatten tokens into a single array and score each token
+        lengths = np.array([len(tokens) for tokens in sent_tokens], dtype=np.int64)
+        tokens = [t for sent in sent_tokens for t in sent]
+        pos_tags = [p for sent in batch.pos_tags for p in sent]
+        doc_ids = np.repeat(batch.doc_id.to_numpy(), lengths)
+        token_scores = get_token_scores(tokens, pos_tags, doc_ids, vocab, tfidf_corpus, tfidf, max_token_scores,
+                                        include_sentiment)
+
+        # Index of the first token in each window, for all windows of all sentences
+        window_cnts = lengths - window_size + 1
+        sent_offsets = np.cumsum(lengths) - lengths
+        window_offsets = np.cumsum(window_cnts) - window_cnts
+        window_starts = np.repeat(sent_offsets - window_offsets, window_cnts) + np.arange(window_cnts.sum())
+
+        # Score each phrase in the sentence
+        phrase_scores = get_window_scores(token_scores, window_starts, window_size)
+        if include_sentiment:
+            if sentiment_mode == 'fast':
+                weights = 1 + np.abs(get_window_polarity(tokens, window_starts, window_size))
+            else:
+                weights = [1 + abs(get_polarity(" ".join(tokens[w:w + window_size]))) for w in window_starts]
+            score_type = type(phrase_scores.dtype.type(0) * 1.0)
+            phrase_scores = phrase_scores.astype(score_type) * np.array(weights).astype(score_type)
+
+        # Find the first window with the highest score in each sentence
+        max_scores = np.maximum.reduceat(phrase_scores, window_offsets)
+        is_max = phrase_scores == np.repeat(max_scores, window_cnts)
+        max_ix = np.where(is_max, np.arange(len(phrase_scores)), len(phrase_scores))
+        best_windows = np.minimum.reduceat(max_ix, window_offsets) - window_offsets
+
+        phrases += [sent[w:w + window_size] for sent, w in zip(sent_tokens, best_windows)]
+
+    return phrases
+
 # Cell
 def get_vector_tfidf(sent:Series, dictionary:gensim.corpora.dictionary.Dictionary, term_matrix:np.ndarray):
     """
-    Create a word vector for a given sentence using a term matrix.
+    Create a word vector for a given sentence using a (dense or sparse) term matrix.
     This function is called in a lambda expression in `core.get_vectors`.
 
     Returns list
     """
     vec_ids = [x[0] for x in dictionary.doc2bow(sent.phrase)]
-    return term_matrix[vec_ids].sum(axis=0)
+
+    # Summing rows of a sparse matrix returns a 1 x n matrix, so flatten it to match the dense case
+    return np.asarray(term_matrix[vec_ids].sum(axis=0)).ravel()
 
 def get_vector_w2v(sent:Series, model:gensim.models.keyedvectors.Word2VecKeyedVectors):
     """
@@ -103,23 +273,254 @@ def get_vector_w2v(sent:Series, model:gensim.models.keyedvectors.Word2VecKeyedVe
     tokens = [token for token in sent.phrase if token in model.wv.vocab]
     return model[tokens].sum(axis=0)
 
+def get_w2v_term_index(model:gensim.models.keyedvectors.Word2VecKeyedVectors, tokens:set = None):
+    """
+    Maps each word in the vocabulary of a Word2Vec model to its row in `model.wv.vectors`.
+    When `tokens` is passed, only those tokens are mapped, which is much faster for large pretrained models.
+
+    Returns dict
+    """
+    vocab = model.wv.vocab
+    if tokens is None:
+        return {token: v.index for token, v in vocab.items()}
+    return {token: vocab[token].index for token in tokens if token in vocab}
+
+def get_term_subset(term_vectors:np.ndarray, term_index:dict, tokens):
+    """
+    Selects the rows of `term_vectors` for the `tokens` that are in `term_index`.
+
+    Returns (np.ndarray, dict)
+    """
+    terms = [token for token in tokens if token in term_index]
+    rows = np.array([term_index[token] for token in terms], dtype=np.int64)
+    return np.asarray(term_vectors[rows]), {token: i for i, token in enumerate(terms)}
+
+def get_phrase_term_matrix(phrases:list, term_index:dict, n_terms:int, binary:bool = True):
+    """
+    Creates a sparse (phrases x terms) matrix counting the occurrences of each term in each phrase. Tokens missing from
+    `term_index` are ignored. When `binary` is True, a term is counted at most once per phrase.
+
+    Returns scipy.sparse.csr_matrix
+    """
+    lengths = np.array([len(phrase) for phrase in phrases], dtype=np.int64)
+    term_ids = pd.Series([token for phrase in phrases for token in phrase], dtype=object).map(term_index)
+    in_vocab = term_ids.notna().to_numpy()
+    rows = np.repeat(np.arange(len(phrases)), lengths)[in_vocab]
+    cols = term_ids[in_vocab].to_numpy(dtype=np.int64)
+
+    # Duplicate (row, col) entries are summed when the matrix is built
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(phrases), n_terms))
+    if binary:
+        matrix.data[:] = 1
+    return matrix
+
+def get_phrase_vectors(phrases:list, term_vectors:np.ndarray, term_index:dict, binary:bool = True):
+    """
+    Creates a vector for each phrase by summing the rows of a (dense or sparse) term matrix for its tokens.
+    Use `binary` True for TF-IDF based term matrices, which count each token once, and False for Word2Vec vectors.
+
+    Returns np.ndarray
+    """
+    term_matrix = get_phrase_term_matrix(phrases, term_index, term_vectors.shape[0], binary)
+    vectors = term_matrix @ term_vectors
+    return vectors.toarray() if sparse.issparse(vectors) else np.asarray(vectors)
+
+def get_vector_matrix(data:DataFrame):
+    """
+    Gets the phrase vectors in `data.vec` as a 2-D array. When the vectors are rows of one contiguous array (as created
+    by `core.get_vectors`), the rows are gathered from that array instead of being stacked one by one.
+
+    Returns np.ndarray
+    """
+    vecs = list(data.vec)
+    base = vecs[0].base if len(vecs) > 0 and isinstance(vecs[0], np.ndarray) else None
+    if base is None or base.ndim != 2 or not base.flags.c_contiguous:
+        return np.array(vecs)
+
+    # Recover the row of the shared array that each vector is a view of
+    base_ptr, row_bytes = base.__array_interface__['data'][0], base.strides[0]
+    offsets = []
+    for vec in vecs:
+        if not isinstance(vec, np.ndarray) or vec.base is not base or vec.shape != base.shape[1:]:
+            return np.array(vecs)
+        offsets.append(vec.__array_interface__['data'][0] - base_ptr)
+    rows = np.array(offsets) // row_bytes
+    return base if np.array_equal(rows, np.arange(len(base))) else base[rows]
+
 # Cell
-def w2v_pretrained(bin_file:str):
+def w2v_pretrained(bin_file:str, tokens:set = None, cache_dir:str = None):
     """
     Load a pre-trained Word2Vec model from a bin file.
 
+    The first time a bin file is loaded it is converted to gensim's native format (next to the bin file, or in
+    `cache_dir`). Later loads memory-map the converted vectors, so they take seconds and processes loading the same
+    model share its pages. Loaded models are also cached in-process by path. When `tokens` is passed, a small in-memory
+    model with only the vectors for those tokens is returned instead.
+
     Returns gensim.models.keyedvectors.Word2VecKeyedVectors
     """
-    return gensim.models.KeyedVectors.load_word2vec_format(bin_file, binary=True)
+    native_file = get_w2v_native_file(bin_file, cache_dir)
+    if not os.path.exists(native_file):
+        model = gensim.models.KeyedVectors.load_word2vec_format(bin_file, binary=True)
+        # Store the vectors in their own .npy file so they can be memory-mapped
+        model.save(native_file, separately=['vectors'])
+    model = load_w2v_native(native_file)
+
+    # Optionally copy the vectors of the corpus tokens into a small model
+    if tokens is not None:
+        return get_w2v_subset(model, tokens)
+    return model
+
+def get_w2v_native_file(bin_file:str, cache_dir:str = None):
+    """
+    Gets the path of the native gensim copy of a Word2Vec bin file.
+
+    Returns str
+    """
+    if cache_dir is None:
+        return bin_file + '.kv'
+    os.makedirs(cache_dir, exist_ok=True)
+    path_hash = hashlib.sha256(os.path.abspath(bin_file).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(bin_file)}.{path_hash}.kv")
+
+@lru_cache(maxsize=4)
+def load_w2v_native(native_file:str):
+    """
+    Loads a Word2Vec model saved in gensim's native format with its vectors memory-mapped read-only.
+
+    Returns gensim.models.keyedvectors.Word2VecKeyedVectors
+    """
+    return gensim.models.KeyedVectors.load(native_file, mmap='r')
+
+def get_w2v_subset(model:gensim.models.keyedvectors.Word2VecKeyedVectors, tokens:set):
+    """
+    Creates an in-memory Word2Vec model holding only the vectors of the `tokens` that are in the model's vocabulary.
+
+    Returns gensim.models.keyedvectors.Word2VecKeyedVectors
+    """
+    words = sorted(token for token in tokens if token in model.vocab)
+    subset = gensim.models.KeyedVectors(model.vector_size)
+    if len(words) > 0:
+        subset.add(words, np.array(model[words]))
+    return subset
+
+def w2v_local(docs:list = None, workers:int = 3, epochs:int = 500, patience:int = None, tol:float = 1e-3,
+              cache_dir:str = None, corpus_file:str = None):
+    """
+    Trains a Word2Vec model on the token lists in `docs`.
+
+    `workers` is the number of training threads and `epochs` the maximum number of passes over the corpus. When
+    `patience` is set, the model is trained one epoch at a time on the same decaying learning rate and training stops
+    once the epoch loss has not improved by a fraction `tol` for `patience` epochs. When `cache_dir` is set, the trained
+    model is saved there under a fingerprint of the corpus and settings and reloaded instead of retrained. When
+    `corpus_file` is set, gensim trains from that file (one space-separated document per line), which scales better
+    across workers; the file is (re)written from `docs` whenever `docs` is given, and used as is otherwise. The file
+    format can't hold tokens containing whitespace (e.g. entities), so `docs` with such tokens are trained on directly
+    instead.
+
+    Returns gensim.models.Word2Vec
+    """
+    params = dict(sg=1, window=6, max_vocab_size=None, min_count=1, size=10)
+
+    # Tokens containing whitespace would be split when gensim reads the corpus file
+    if corpus_file is not None and docs is not None and any(len(token.split()) != 1 for doc in docs for token in doc):
+        print("Tokens contain whitespace, training without corpus_file.")
+        corpus_file = None
+
+    # Optionally write the corpus to disk for corpus_file mode
+    if corpus_file is not None and docs is not None:
+        with open(corpus_file, 'w', encoding='utf-8') as f:
+            for doc in docs:
+                f.write(" ".join(doc) + "\n")
+
+    # Optionally reuse a model trained on the same corpus with the same settings
+    if cache_dir is not None:
+        fingerprint = get_w2v_fingerprint(docs, corpus_file, dict(params, epochs=epochs, patience=patience, tol=tol))
+        model_file = os.path.join(cache_dir, f"w2v_local.{fingerprint}.model")
+        if os.path.exists(model_file):
+            return models.Word2Vec.load(model_file)
+
+    model = models.Word2Vec(iter=epochs, workers=workers, **params)
+    if corpus_file is not None:
+        model.build_vocab(corpus_file=corpus_file)
+        train_args = dict(corpus_file=corpus_file, total_words=model.corpus_total_words)
+    else:
+        model.build_vocab(docs)
+        train_args = dict(sentences=docs, total_examples=model.corpus_count)
+
+    if patience is None:
+        model.train(epochs=model.epochs, **train_args)
+    else:
+        # Train one epoch at a time, decaying the learning rate as a single call with `epochs` epochs would
+        alphas = np.linspace(model.alpha, model.min_alpha, epochs + 1)
+        best_loss, since_best = np.inf, 0
+        for epoch in range(epochs):
+            model.train(epochs=1, start_alpha=alphas[epoch], end_alpha=alphas[epoch + 1], compute_loss=True,
+                        **train_args)
+            loss = model.get_latest_training_loss()
+            if loss < best_loss * (1 - tol):
+                best_loss, since_best = loss, 0
+            else:
+                since_best += 1
+            if since_best >= patience:
+                break
+
+    # Optionally cache the trained model
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        model.save(model_file)
+
+    return model
+
+def get_w2v_fingerprint(docs:list, corpus_file:str, params:dict):
+    """
+    Hashes the training corpus (`docs`, or the contents of `corpus_file`) together with the training `params`.
+
+    Returns str
+    """
+    h = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8'))
+    if corpus_file is not None:
+        with open(corpus_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    else:
+        for doc in docs:
+            h.update(("\x1f".join(doc) + "\x1e").encode('utf-8'))
+    return h.hexdigest()
 
 # Cell
 def get_cluster_assignments_hac(linkage_matrix:np.ndarray, height:int):
     """
     Assigns clusters by cutting the HAC dendrogram at the specified height.
 
+    Every merge below `height` is applied by pointing both merged nodes at their parent, and each leaf is followed up to
+    its root by pointer jumping. Clusters are numbered by their first member, which gives the same labels as
+    `cut_tree` without its quadratic loop over the merges.
+
     Returns list
     """
-    return [x[0] for x in cut_tree(linkage_matrix, height=height)]
+    # Merge heights that decrease (e.g. with a connectivity constraint) need cut_tree's ordering of the merges
+    if not np.all(np.diff(linkage_matrix[:, 2]) >= 0):
+        return [x[0] for x in cut_tree(linkage_matrix, height=height)]
+
+    n = len(linkage_matrix) + 1
+    children = linkage_matrix[:, :2].astype(np.int64)
+    applied = linkage_matrix[:, 2] < height
+    parent = np.arange(2 * n - 1)
+    merges = np.nonzero(applied)[0]
+    parent[children[merges, 0]] = merges + n
+    parent[children[merges, 1]] = merges + n
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+
+    # Number clusters in order of their first member
+    _, first, inverse = np.unique(parent[:n], return_index=True, return_inverse=True)
+    ranks = np.empty(len(first), dtype=np.int64)
+    ranks[np.argsort(first)] = np.arange(len(first))
+    return list(ranks[inverse])
 
 def get_silhouette_score_hac(phrase_vecs:list, linkage_matrix:np.ndarray, height:int):
     """
@@ -137,18 +538,56 @@ def get_silhouette_score_hac(phrase_vecs:list, linkage_matrix:np.ndarray, height
 
     return score
 
-def get_tree_height(root:hierarchy.ClusterNode):
+def get_tree_height(linkage_matrix:np.ndarray):
     """
-    Recursively finds the height of a binary tree.
+    Finds the height of the binary tree described by a linkage matrix, counting leaves as height 2.
 
     Returns int
     """
-    if root is None:
-        return 1
-    return max(get_tree_height(root.left), get_tree_height(root.right)) + 1
+    n = len(linkage_matrix) + 1
+    heights = np.full(n + len(linkage_matrix), 2)
+    for i, (left, right) in enumerate(linkage_matrix[:, :2].astype(int)):
+        heights[n + i] = max(heights[left], heights[right]) + 1
+    return int(heights[-1])
+
+def get_height_scores(phrase_vecs:np.ndarray, linkage_matrix:np.ndarray, h_range:range, n_jobs:int = 1,
+                      sample_size:int = None, random_state:int = 42, max_precomputed:int = 5000):
+    """
+    Calculates the silhouette score of the HAC clustering at each height in `h_range`.
+    The dendrogram is cut at every height in one pass. Heights that produce the same clustering are only scored once,
+    and the remaining clusterings are scored on `n_jobs` processes. When `sample_size` is set, silhouette scores are
+    calculated on a random sample of that many phrases. Pairwise distances are calculated once and shared by all
+    clusterings when at most `max_precomputed` phrases are scored; otherwise each clustering is scored with chunked
+    distances so that memory does not grow with n².
+
+    Returns DataFrame
+    """
+    h_values = np.array(list(h_range))
+
+    # cut_tree applies every merge below the cut height, so heights with the same merge count share a clustering
+    merge_counts = np.searchsorted(np.sort(linkage_matrix[:, 2]), h_values)
+    _, first_idx, inverse = np.unique(merge_counts, return_index=True, return_inverse=True)
+    assignments = cut_tree(linkage_matrix, height=h_values[first_idx])
+
+    # Optionally score a random sample of the phrases
+    phrase_vecs = np.asarray(phrase_vecs)
+    if sample_size is not None and sample_size < len(phrase_vecs):
+        sample = np.random.RandomState(random_state).choice(len(phrase_vecs), sample_size, replace=False)
+        phrase_vecs, assignments = phrase_vecs[sample], assignments[sample]
+
+    if len(phrase_vecs) <= max_precomputed:
+        dist = pairwise_distances(phrase_vecs)
+        scores = Parallel(n_jobs=n_jobs)(delayed(get_silhouette_score_labels)(dist, assignments[:, i],
+                                                                              metric="precomputed")
+                                         for i in range(len(first_idx)))
+    else:
+        scores = Parallel(n_jobs=n_jobs)(delayed(get_silhouette_score_labels)(phrase_vecs, assignments[:, i])
+                                         for i in range(len(first_idx)))
+    return DataFrame({'height': h_values, 'score': np.array(scores, dtype=float)[inverse.ravel()]})
 
 def get_optimal_height(data:DataFrame, linkage_matrix:np.ndarray, max_h:int, show_chart:bool = True,
-                       save_chart:bool = False, chart_file:str = "HACSilhouette.png"):
+                       save_chart:bool = False, chart_file:str = "HACSilhouette.png", n_jobs:int = 1,
+                       sample_size:int = None):
     """
     Clusters the top phrase vectors and plots the silhoute coefficients for a range of dendrograph heights.
     Returns the optimal height value (highest silhoute coefficient)
@@ -156,8 +595,8 @@ def get_optimal_height(data:DataFrame, linkage_matrix:np.ndarray, max_h:int, sho
     Returns int
     """
     h_range = range(2,max_h)
-    phrase_vecs = list(data.vec)
-    h_scores = [get_silhouette_score_hac(phrase_vecs, linkage_matrix, h) for h in h_range]
+    phrase_vecs = get_vector_matrix(data)
+    h_scores = get_height_scores(phrase_vecs, linkage_matrix, h_range, n_jobs=n_jobs, sample_size=sample_size).score
 
     # Optionally display the graph of silhouette score by height
     if show_chart:
@@ -172,26 +611,74 @@ def get_optimal_height(data:DataFrame, linkage_matrix:np.ndarray, max_h:int, sho
     optimal_height = h_range[np.argmax(h_scores)]
     return optimal_height
 
+def get_linkage_knn(phrase_vecs:np.ndarray, n_neighbors:int = 15, dist_metric:str = "euclidean"):
+    """
+    Builds a Ward linkage matrix constrained to merges between clusters connected in the `n_neighbors` nearest
+    neighbor graph of the phrase vectors. Memory grows with n * `n_neighbors` instead of n².
+
+    Returns np.ndarray
+    """
+    n = len(phrase_vecs)
+    connectivity = kneighbors_graph(phrase_vecs, n_neighbors=min(n_neighbors, n - 1), metric=dist_metric,
+                                    include_self=False)
+    model = AgglomerativeClustering(n_clusters=None, distance_threshold=0, linkage='ward', connectivity=connectivity,
+                                    compute_full_tree=True).fit(phrase_vecs)
+
+    # Convert to scipy's linkage format, which also records the size of each merged cluster
+    counts = np.ones(2 * n - 1)
+    for i, (left, right) in enumerate(model.children_):
+        counts[n + i] = counts[left] + counts[right]
+    distances = np.maximum.accumulate(model.distances_)
+    return np.column_stack([model.children_, distances, counts[n:]]).astype(float)
+
+def get_linkage_matrix(phrase_vecs:np.ndarray, dist_metric:str, hac_mode:str = "square", n_neighbors:int = 15):
+    """
+    Builds the Ward linkage matrix used for Hierarchical Agglomerative Clustering (HAC).
+
+    Options for `hac_mode` are ('square', 'vectors', 'knn'). 'square' clusters the rows of the full n x n distance
+    matrix. 'vectors' clusters the phrase vectors directly (after L2-normalization for 'cosine') using condensed
+    distances. 'knn' constrains merges to the `n_neighbors` nearest neighbor graph and scales to 100k+ phrases.
+
+    Returns np.ndarray
+    """
+    if hac_mode == "square":
+        if dist_metric == "cosine":
+            dist = 1 - cosine_similarity(phrase_vecs)
+        else:
+            dist = pairwise_distances(phrase_vecs, metric=dist_metric)
+        return ward(dist)
+
+    # Ward merges are defined on euclidean distances, so cosine distances are taken between unit vectors
+    if dist_metric == "cosine":
+        phrase_vecs = normalize(phrase_vecs)
+        dist_metric = "euclidean"
+
+    if hac_mode == "vectors":
+        if dist_metric == "euclidean":
+            return linkage(phrase_vecs, method='ward')
+        return ward(pdist(phrase_vecs, metric=dist_metric))
+    elif hac_mode == "knn":
+        return get_linkage_knn(phrase_vecs, n_neighbors, dist_metric)
+    else:
+        raise Exception(f"Unrecognized hac_mode: '{hac_mode}'")
+
 def get_clusters_hac(data:DataFrame, dist_metric:str, height:int = None, show_dendrogram:bool = False,
-                     show_chart:bool = False):
+                     show_chart:bool = False, n_jobs:int = 1, hac_mode:str = "square", n_neighbors:int = 15,
+                     sample_size:int = None):
     """
     Use Hierarchical Agglomerative Clustering (HAC) to cluster phrase vectors
 
     Returns (list, np.ndarray, int)
     """
     # Create a linkage matrix
-    if dist_metric == "cosine":
-        dist = 1 - cosine_similarity(list(data.vec))
-    else:
-        dist = pairwise_distances(list(data.vec), metric=dist_metric)
-    linkage_matrix = ward(dist)
+    linkage_matrix = get_linkage_matrix(get_vector_matrix(data), dist_metric, hac_mode, n_neighbors)
 
     # Maximum cut point height is the height of the tree
-    max_h = get_tree_height(hierarchy.to_tree(linkage_matrix)) + 1
+    max_h = get_tree_height(linkage_matrix) + 1
 
     # Use optimal height if no height is specified
     if height is None:
-        height = get_optimal_height(data, linkage_matrix, max_h, show_chart)
+        height = get_optimal_height(data, linkage_matrix, max_h, show_chart, n_jobs=n_jobs, sample_size=sample_size)
 
     cluster_assignments = get_cluster_assignments_hac(linkage_matrix, height)
 
@@ -212,54 +699,203 @@ def get_silhouette_score_kmeans(phrase_vecs:list, k:int):
     cluster_assignments = KMeans(k).fit(phrase_vecs).predict(phrase_vecs)
     return silhouette_score(phrase_vecs, cluster_assignments)
 
+def get_silhouette_score_labels(phrase_vecs:np.ndarray, cluster_assignments:np.ndarray, sample_size:int = None,
+                                random_state:int = 42, metric:str = "euclidean"):
+    """
+    Calculates the silhouette score of a clustering, optionally on a random sample of `sample_size` phrases.
+    Pass a square distance matrix as `phrase_vecs` with `metric` 'precomputed' to reuse distances across clusterings.
+    Clusterings with fewer than 2 (or as many as n) distinct clusters score -1.
+
+    Returns float
+    """
+    n_labels = len(np.unique(cluster_assignments))
+    if n_labels < 2 or n_labels >= len(cluster_assignments):
+        return -1
+    if sample_size is not None and sample_size >= len(cluster_assignments):
+        sample_size = None
+    return silhouette_score(phrase_vecs, cluster_assignments, metric=metric, sample_size=sample_size,
+                            random_state=random_state)
+
+def score_k_chain(phrase_vecs:np.ndarray, k_values:list, warm_start:bool = True, patience:int = None,
+                  sample_size:int = None, random_state:int = 42):
+    """
+    Clusters `phrase_vecs` with K-means for each k in the ascending list `k_values` and scores each clustering.
+    When `warm_start` is True, each fit is initialized with the centroids of the previous k plus the phrases farthest
+    from their nearest centroid. When `patience` is set, the chain stops after that many k-values without improving on
+    its best score.
+
+    Returns list of (k, score) tuples
+    """
+    scores, centers = [], None
+    best_score, since_best = -np.inf, 0
+    for k in k_values:
+        if warm_start and centers is not None:
+            # Grow the previous centroids farthest-first to get k initial centroids
+            nearest = pairwise_distances(phrase_vecs, centers).min(axis=1)
+            while len(centers) < k:
+                idx = np.argmax(nearest)
+                centers = np.vstack([centers, phrase_vecs[idx]])
+                nearest = np.minimum(nearest, pairwise_distances(phrase_vecs, phrase_vecs[idx:idx+1]).ravel())
+            kmeans = KMeans(n_clusters=k, init=centers, n_init=1, random_state=random_state).fit(phrase_vecs)
+        else:
+            kmeans = KMeans(n_clusters=k, random_state=random_state).fit(phrase_vecs)
+        centers = kmeans.cluster_centers_
+        score = get_silhouette_score_labels(phrase_vecs, kmeans.labels_, sample_size, random_state)
+        scores.append((k, score))
+
+        # Optionally stop once the score has not improved for `patience` k-values
+        if score > best_score:
+            best_score, since_best = score, 0
+        else:
+            since_best += 1
+        if patience is not None and since_best >= patience:
+            break
+    return scores
+
+def get_k_scores(phrase_vecs:np.ndarray, k_range:range, search:str = "full", n_jobs:int = 1, warm_start:bool = True,
+                 sample_size:int = None, patience:int = 5, coarse_step:int = 5, random_state:int = 42):
+    """
+    Calculates the silhouette score of K-means clusterings for the k-values in `k_range`.
+
+    Options for `search` are ('full', 'coarse', 'early_stop'). 'full' scores every k. 'coarse' scores every
+    `coarse_step`-th k and then every k within `coarse_step` of the best one. 'early_stop' stops scoring once the score
+    has not improved for `patience` consecutive k-values. The k-values are split into `n_jobs` contiguous chains that
+    run in parallel, each warm-starting from the centroids of its previous k when `warm_start` is True. When
+    `sample_size` is set, silhouette scores are calculated on a random sample of that many phrases.
+
+    Returns DataFrame
+    """
+    phrase_vecs = np.asarray(phrase_vecs)
+    k_values = list(k_range)
+
+    def score_chains(k_values:list, patience:int = None):
+        n_chains = max(1, min(effective_n_jobs(n_jobs), len(k_values)))
+        chains = [[int(k) for k in chain] for chain in np.array_split(k_values, n_chains) if len(chain) > 0]
+        results = Parallel(n_jobs=n_jobs)(delayed(score_k_chain)(phrase_vecs, chain, warm_start, patience, sample_size,
+                                                                 random_state) for chain in chains)
+        return [score for chain_scores in results for score in chain_scores]
+
+    if search == "full":
+        scores = score_chains(k_values)
+    elif search == "early_stop":
+        scores = score_chains(k_values, patience)
+    elif search == "coarse":
+        # Score a coarse grid of k-values, then every k-value near the best one
+        scores = score_chains(k_values[::coarse_step])
+        best_k = max(scores, key=lambda x: x[1])[0]
+        scored = set(k for k, score in scores)
+        fine_k = [k for k in k_values if abs(k - best_k) < coarse_step and k not in scored]
+        scores += score_chains(fine_k) if fine_k else []
+    else:
+        raise Exception(f"Unrecognized search: '{search}'")
+
+    return DataFrame(scores, columns=['k', 'score']).sort_values('k').reset_index(drop=True)
+
 def get_optimal_k(data:DataFrame, show_chart:bool = True, save_chart:bool = False,
-                  chart_file:str = "KmeansSilhouette.png"):
+                  chart_file:str = "KmeansSilhouette.png", search:str = "full", n_jobs:int = 1,
+                  sample_size:int = None):
     """
     Calculates the optimal k-value (highest silhoute coefficient).
     Optionally prints a chart of silhouette score by k-value or saves it to disk.
+    `search`, `n_jobs` and `sample_size` are passed to `get_k_scores`.
 
     Returns int
     """
-    phrase_vecs = list(data.vec)
+    phrase_vecs = get_vector_matrix(data)
     max_k = min(len(phrase_vecs), 100)
-    k_range = range(2, max_k)
-    score = [get_silhouette_score_kmeans(phrase_vecs, i) for i in k_range]
+    k_scores = get_k_scores(phrase_vecs, range(2, max_k), search=search, n_jobs=n_jobs, sample_size=sample_size)
 
     # Optionally display the graph of silhouette score by k-value
     if show_chart:
-        fig = plt.plot(k_range, score)
+        fig = plt.plot(k_scores.k, k_scores.score)
 
     # Optionally save the graph of silhouette score by k-value to disk
     if save_chart:
         plt.savefig(chart_file, dpi=300)
 
     # optimal_k is k value with the highest silhouette score
-    optimal_k = k_range[np.argmax(score)]
+    optimal_k = int(k_scores.k[k_scores.score.idxmax()])
     return optimal_k
 
-def get_cluster_assignments_kmeans(phrase_vecs:list, k:int):
+def iter_vector_chunks(phrase_vecs, chunk_size:int = None):
     """
-    K-means clustering.
+    Yields chunks of `chunk_size` phrase vectors from an array, a list or the path to a .npy file, which is memory
+    mapped rather than loaded. Yields all vectors at once if `chunk_size` is None.
 
-    Returns list
+    Returns generator of np.ndarray
     """
-    # Assign clusters
-    kmeans = KMeans(n_clusters=k, random_state=42).fit(phrase_vecs)
-    cluster_assignments = kmeans.predict(phrase_vecs)
-    return cluster_assignments
+    if isinstance(phrase_vecs, str):
+        phrase_vecs = np.load(phrase_vecs, mmap_mode='r')
+    elif isinstance(phrase_vecs, list):
+        phrase_vecs = np.array(phrase_vecs)
+    chunk_size = chunk_size or len(phrase_vecs)
+    for start in range(0, len(phrase_vecs), chunk_size):
+        yield np.asarray(phrase_vecs[start:start+chunk_size])
+
+def fit_kmeans(phrase_vecs, k:int, kmeans_mode:str = "full", batch_size:int = 1024, chunk_size:int = None,
+               random_state:int = 42):
+    """
+    Fits a K-means model to the phrase vectors, which may be an array, a list or the path to a .npy file.
+
+    Options for `kmeans_mode` are ('full', 'minibatch'). 'minibatch' fits sklearn's MiniBatchKMeans with batches of
+    `batch_size` phrases. When `chunk_size` is set, the phrase vectors are read and passed to `partial_fit` that many
+    at a time so they never need to be in memory at once; the model can keep learning from new batches the same way.
+
+    Returns (KMeans or MiniBatchKMeans, np.ndarray)
+    """
+    if kmeans_mode == "full":
+        kmeans = KMeans(n_clusters=k, random_state=random_state).fit(next(iter_vector_chunks(phrase_vecs)))
+        return kmeans, kmeans.labels_
+    elif kmeans_mode != "minibatch":
+        raise Exception(f"Unrecognized kmeans_mode: '{kmeans_mode}'")
+
+    kmeans = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, random_state=random_state)
+    if chunk_size is None:
+        kmeans.fit(next(iter_vector_chunks(phrase_vecs)))
+        return kmeans, kmeans.labels_
+
+    # Stream chunks through partial_fit, then label every phrase with the final centroids
+    for chunk in iter_vector_chunks(phrase_vecs, chunk_size):
+        kmeans.partial_fit(chunk)
+    return kmeans, predict_kmeans(kmeans, phrase_vecs, chunk_size)
+
+def predict_kmeans(kmeans_model:KMeans, phrase_vecs, chunk_size:int = None):
+    """
+    Assigns phrase vectors to the nearest centroid of a fitted K-means model, `chunk_size` vectors at a time.
+
+    Returns np.ndarray
+    """
+    return np.concatenate([kmeans_model.predict(chunk) for chunk in iter_vector_chunks(phrase_vecs, chunk_size)])
+
+def get_cluster_assignments_kmeans(phrase_vecs, k:int, kmeans_model:KMeans = None, kmeans_mode:str = "full",
+                                   batch_size:int = 1024, chunk_size:int = None):
+    """
+    K-means clustering. Reuses `kmeans_model` instead of refitting when it was fitted with `k` clusters.
 
-def get_clusters_kmeans(data:DataFrame, k:int = None, show_chart:bool = False):
+    Returns (np.ndarray, KMeans or MiniBatchKMeans)
+    """
+    # Assign clusters
+    if kmeans_model is not None and kmeans_model.n_clusters == k:
+        return predict_kmeans(kmeans_model, phrase_vecs, chunk_size), kmeans_model
+    kmeans_model, cluster_assignments = fit_kmeans(phrase_vecs, k, kmeans_mode, batch_size, chunk_size)
+    return cluster_assignments, kmeans_model
+
+def get_clusters_kmeans(data:DataFrame, k:int = None, show_chart:bool = False, search:str = "full", n_jobs:int = 1,
+                        sample_size:int = None, kmeans_mode:str = "full", batch_size:int = 1024,
+                        chunk_size:int = None):
     """
     Use K-means algorithm to cluster phrase vectors
 
-    Returns list
+    Returns (np.ndarray, KMeans or MiniBatchKMeans, int)
     """
 
     # Use optimal k if no k-value is specified
     if k is None:
-        k = get_optimal_k(data, show_chart)
+        k = get_optimal_k(data, show_chart, search=search, n_jobs=n_jobs, sample_size=sample_size)
 
-    return get_cluster_assignments_kmeans(list(data.vec), k), k
+    cluster_assignments, kmeans_model = get_cluster_assignments_kmeans(get_vector_matrix(data), k, kmeans_mode=kmeans_mode,
+                                                                       batch_size=batch_size, chunk_size=chunk_size)
+    return cluster_assignments, kmeans_model, k
 
 # Cell
 def get_topics_from_docs(docs:list, topic_count:int):
@@ -277,6 +913,108 @@ def get_topics_from_docs(docs:list, topic_count:int):
     topics = list(np.array(topics_matrix[0][1])[:,0])
     return topics
 
+def get_term_counts(docs:list):
+    """
+    Creates a sparse (docs x terms) matrix of token counts for the lists of tokens in `docs`.
+
+    Returns (scipy.sparse.csr_matrix, np.ndarray)
+    """
+    lengths = np.array([len(doc) for doc in docs], dtype=np.int64)
+    term_ids, terms = pd.factorize(pd.Series([token for doc in docs for token in doc], dtype=object))
+    rows = np.repeat(np.arange(len(docs)), lengths)
+    counts = sparse.csr_matrix((np.ones(len(term_ids)), (rows, term_ids)), shape=(len(docs), len(terms)))
+    return counts, np.asarray(terms, dtype=object)
+
+def get_topics_ctfidf(docs:list, groups:np.ndarray, topic_count:int, term_counts:tuple = None):
+    """
+    Gets the `topic_count` terms with the highest class-based TF-IDF (c-TF-IDF) for each group of docs.
+
+    The token counts of all docs are summed per group with one sparse matrix product. A term's score in a group is its
+    frequency in the group times log(1 + average number of tokens per group / occurrences of the term in all groups).
+    `term_counts` is the output of `get_term_counts` for `docs`, if already computed.
+
+    Returns Series
+    """
+    counts, terms = term_counts if term_counts is not None else get_term_counts(docs)
+    group_ids, group_labels = pd.factorize(pd.Series(groups), sort=True)
+    indicator = sparse.csr_matrix((np.ones(len(docs)), (group_ids, np.arange(len(docs)))),
+                                  shape=(len(group_labels), len(docs)))
+    group_counts = (indicator @ counts).tocsr()
+
+    # Weight the term frequencies within each group by how concentrated each term is in few groups
+    term_totals = np.asarray(group_counts.sum(axis=0)).ravel()
+    avg_tokens = group_counts.sum() / max(len(group_labels), 1)
+    idf = np.log(1 + avg_tokens / np.maximum(term_totals, 1))
+    scores = (normalize(group_counts, norm='l1') @ sparse.diags(idf)).tocsr()
+
+    # Highest scoring terms in each group, ties broken by first occurrence
+    topics = []
+    for i in range(len(group_labels)):
+        cols = scores.indices[scores.indptr[i]:scores.indptr[i + 1]]
+        vals = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+        top = cols[np.lexsort((cols, -vals))[:topic_count]]
+        topics.append(list(terms[top]))
+    return Series(topics, index=group_labels)
+
+def get_group_topics(docs:list, groups:np.ndarray, topic_count:int, method:str = "ctfidf", n_jobs:int = 1):
+    """
+    Gets a list of `topic_count` topics for each group of docs, where `groups` is the group of each list of tokens in
+    `docs`.
+
+    Options for `method` are ('ctfidf', 'lda'). 'ctfidf' scores every group at once with `get_topics_ctfidf`. 'lda'
+    fits a one-topic LDA model per group with `get_topics_from_docs`, running the fits on `n_jobs` processes.
+
+    Returns Series
+    """
+    if method == "ctfidf":
+        return get_topics_ctfidf(docs, groups, topic_count)
+    elif method == "lda":
+        group_rows = Series(np.arange(len(docs))).groupby(np.asarray(groups)).indices
+        topics = Parallel(n_jobs=n_jobs)(delayed(get_topics_from_docs)([docs[i] for i in rows], topic_count)
+                                         for rows in group_rows.values())
+        return Series(topics, index=list(group_rows.keys()))
+    else:
+        raise Exception(f"Unrecognized method: '{method}'")
+
+def get_group_topics_cached(docs:list, groups:np.ndarray, topic_count:int, topic_cache:dict, method:str = "ctfidf",
+                            n_jobs:int = 1, doc_ids:list = None):
+    """
+    Gets the same topics as `get_group_topics`, reusing the results stored in `topic_cache` by earlier calls on the same
+    `docs`.
+
+    With 'lda', topics are stored by the member set of each group, so only groups whose members changed are refit.
+    With 'ctfidf', every group's scores depend on all groups, so only the token counts of `docs` are stored.
+    The cache is tied to a fingerprint of `docs` (or of `doc_ids`, the ids of the docs, which is quicker to compute)
+    and is cleared when it is used with different docs.
+
+    Returns Series
+    """
+    h = hashlib.sha256(str(len(docs)).encode('utf-8'))
+    for doc in (map(str, doc_ids) if doc_ids is not None else ("\x1f".join(doc) for doc in docs)):
+        h.update((doc + "\x1e").encode('utf-8'))
+    if topic_cache.get("fingerprint") != h.hexdigest():
+        topic_cache.clear()
+        topic_cache["fingerprint"] = h.hexdigest()
+
+    if method == "ctfidf":
+        if "term_counts" not in topic_cache:
+            topic_cache["term_counts"] = get_term_counts(docs)
+        return get_topics_ctfidf(docs, groups, topic_count, topic_cache["term_counts"])
+    elif method == "lda":
+        group_rows = Series(np.arange(len(docs))).groupby(np.asarray(groups)).indices
+        keys = {group: ("lda", topic_count, rows.tobytes()) for group, rows in group_rows.items()}
+
+        # Fit only the groups with a new member set
+        missing = [group for group, key in keys.items() if key not in topic_cache]
+        if missing:
+            rows = np.concatenate([group_rows[group] for group in missing])
+            topics = get_group_topics([docs[i] for i in rows], np.asarray(groups)[rows], topic_count, method, n_jobs)
+            for group in missing:
+                topic_cache[keys[group]] = topics[group]
+        return Series([topic_cache[key] for key in keys.values()], index=list(keys))
+    else:
+        raise Exception(f"Unrecognized method: '{method}'")
+
 # Cell
 def df_to_disk(df:DataFrame, file_name:str, mode:str="w", header:bool=True, sep='\t'):
     """
@@ -311,29 +1049,516 @@ def write_cluster(cluster_rows:DataFrame, file_name:str, mode:str = 'a', header:
 
 
 def clusters_to_disk(data:DataFrame, doc_df:DataFrame, cluster_df:DataFrame,
-                     file_name:str = 'output/TopicClusterResults.txt'):
+                     file_name:str = 'output/TopicClusterResults.txt', output_format:str = "txt"):
     """
     Writes the sentences and phrases to a file organized by cluster and document.
 
+    Options for `output_format` are ('txt', 'parquet', 'jsonl'). 'txt' writes a tab delimited report with a header line
+    containing the keywords of each cluster. 'parquet' and 'jsonl' write the same rows with the keywords of their
+    cluster in a `keywords` column.
+
     Returns None
     """
-    # Create a dataframe containing the data to be saved to disk
-    df = data[["cluster", "doc_id", "sent_id", "text", "phrase"]].copy()
-    doc_names = [doc_df.loc[c].doc_name for c in data.doc_id]
-    df.insert(loc=3, column='doc_name', value=doc_names)
-    df.sort_values(by=["cluster", "doc_id", "sent_id"], inplace=True)
-
-    # Write document header
-    cluster_rows = pd.DataFrame(None, columns=df.columns)
-    write_cluster(cluster_rows, file_name, mode = 'w', header=True)
-
-    # Write each cluster
-    for c in set(data.cluster):
-        # Write a cluster header containing the main topics for each cluster
-        with open(file_name, encoding="utf-8", mode = 'a') as file:
-            keywords = ', '.join(cluster_df.loc[c, 'topics'])
-            file.write(f"Cluster: {c}; Keywords: [{keywords}]\n")
-
-        # Write the sentences in each cluster
-        cluster_rows = df[df.cluster == c].copy()
-        write_cluster(cluster_rows, file_name)
\ No newline at end of file
+    # Create a dataframe containing the data to be saved to disk, with document names joined in by doc_id
+    df = data[["cluster", "doc_id", "sent_id", "text", "phrase"]]
+    df = df.merge(doc_df[["doc_name"]], how="left", left_on="doc_id", right_index=True)
+    df = df[["cluster", "doc_id", "sent_id", "doc_name", "text", "phrase"]]
+    df = df.sort_values(by=["cluster", "doc_id", "sent_id"])
+    keywords = dict(zip(cluster_df.cluster, cluster_df.topics))
+
+    # Create the output directory if it doesn't exist
+    os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+
+    if output_format == "txt":
+        csv_args = dict(sep='\t', index=False, quoting=csv.QUOTE_NONE, quotechar="", escapechar="\\")
+        with open(file_name, encoding="utf-8", mode="w", newline="") as file:
+            # Write document header
+            df.iloc[:0].to_csv(file, header=True, **csv_args)
+
+            # Write each cluster with a header containing its main topics
+            for c, cluster_rows in df.groupby("cluster", sort=True):
+                file.write(f"Cluster: {c}; Keywords: [{', '.join(keywords.get(c, []))}]\n")
+                cluster_rows.to_csv(file, header=False, **csv_args)
+
+    # Optionally write the same content as Parquet or JSON lines
+    elif output_format in ("parquet", "jsonl"):
+        df = df.assign(keywords=[list(keywords.get(c, [])) for c in df.cluster])
+        if output_format == "parquet":
+            df.to_parquet(file_name, index=False)
+        else:
+            df.to_json(file_name, orient="records", lines=True, force_ascii=False)
+
+    else:
+        raise Exception(f"Unrecognized output_format: '{output_format}'")
+    print(f"Results saved to {file_name}")
+
+# Cell
+def get_contingency_matrix(labels:np.ndarray, clusters:np.ndarray, label_values:np.ndarray,
+                           cluster_values:np.ndarray):
+    """
+    Counts the items with each combination of label and cluster. Rows follow `label_values` and columns follow the
+    sorted `cluster_values`, which must contain every label and cluster in `labels` and `clusters`.
+
+    Returns np.ndarray
+    """
+    label_ix = pd.Index(label_values).get_indexer(labels)
+    cluster_ix = np.searchsorted(cluster_values, clusters)
+    cells = np.bincount(label_ix * len(cluster_values) + cluster_ix, minlength=len(label_values) * len(cluster_values))
+    return cells.reshape(len(label_values), len(cluster_values))
+
+def get_contingency_metrics(contingency:np.ndarray):
+    """
+    Calculates clustering metrics from a (labels x clusters) contingency matrix of item counts: purity, adjusted Rand
+    index (ARI), normalized mutual information (NMI, arithmetic mean normalization) and B-cubed precision, recall and F1.
+    All metrics are NaN when the matrix holds no items.
+
+    Returns Series
+    """
+    contingency = np.asarray(contingency, dtype=np.float64)
+    n = contingency.sum()
+    if n == 0:
+        return Series(dict(items=0, purity=np.nan, ari=np.nan, nmi=np.nan, bcubed_precision=np.nan,
+                           bcubed_recall=np.nan, bcubed_f1=np.nan))
+    label_sizes, cluster_sizes = contingency.sum(axis=1), contingency.sum(axis=0)
+
+    # Purity: fraction of items belonging to the most common label of their cluster
+    purity = contingency.max(axis=0).sum() / n
+
+    # ARI from the number of item pairs placed together
+    pairs = lambda x: (x * (x - 1) / 2).sum()
+    pairs_both, pairs_labels, pairs_clusters = pairs(contingency), pairs(label_sizes), pairs(cluster_sizes)
+    expected = pairs_labels * pairs_clusters / pairs(np.array([n]))
+    max_index = (pairs_labels + pairs_clusters) / 2
+    ari = (pairs_both - expected) / (max_index - expected) if max_index != expected else 1.0
+
+    # NMI from the mutual information and the entropies of both partitions
+    entropy = lambda x: -np.sum((x[x > 0] / n) * np.log(x[x > 0] / n))
+    nonzero = contingency > 0
+    outer = np.outer(label_sizes, cluster_sizes)[nonzero]
+    mutual_info = np.sum(contingency[nonzero] / n * np.log(contingency[nonzero] * n / outer))
+    mean_entropy = (entropy(label_sizes) + entropy(cluster_sizes)) / 2
+    nmi = mutual_info / mean_entropy if mean_entropy > 0 else 1.0
+
+    # B-cubed precision and recall average, over all items, the share of their cluster (label) with the same label
+    # (cluster)
+    bcubed_precision = np.sum(contingency ** 2 / np.maximum(cluster_sizes, 1)) / n
+    bcubed_recall = np.sum(contingency ** 2 / np.maximum(label_sizes, 1)[:, None]) / n
+    bcubed_f1 = 2 * bcubed_precision * bcubed_recall / (bcubed_precision + bcubed_recall)
+
+    return Series(dict(items=int(n), purity=purity, ari=ari, nmi=nmi, bcubed_precision=bcubed_precision,
+                       bcubed_recall=bcubed_recall, bcubed_f1=bcubed_f1))
+
+# Cell
+def fit_projection(features:np.ndarray, method:str, dist_metric:str, umap_neighbors:int, projection:str,
+                   random_state:int = 42):
+    """
+    Projects `features` to two dimensions. In 'distance' projections the features are rows of a distance matrix, in
+    'vectors' projections they are the phrase vectors themselves. Returns the fitted reducer when it can place new
+    points with `transform`, otherwise None.
+
+    Returns (np.ndarray, object)
+    """
+    if method == "umap":
+        import umap.umap_ as umap
+        metric = 'cosine' if projection == "distance" else dist_metric
+        reducer = umap.UMAP(n_neighbors=umap_neighbors, min_dist=.1, metric=metric, random_state=random_state)
+        return reducer.fit_transform(features), reducer
+    elif method == "tsne":
+        from sklearn.manifold import TSNE
+        return TSNE(n_components=2).fit_transform(features), None
+    elif method == "mds":
+        from sklearn.manifold import MDS
+        dist = features if projection == "distance" else pairwise_distances(features, metric=dist_metric)
+        return MDS(n_components=2, dissimilarity="precomputed", random_state=random_state).fit_transform(dist), None
+    elif method == "svd":
+        reducer = TruncatedSVD(n_components = 2, random_state = random_state)
+        return reducer.fit_transform(features), reducer
+    else:
+        raise Exception(f"Unrecognized method: '{method}'")
+
+def place_by_neighbors(phrase_vecs:np.ndarray, landmark_vecs:np.ndarray, landmark_coords:np.ndarray,
+                       dist_metric:str, n_neighbors:int = 10):
+    """
+    Places phrases in an existing 2-D projection at the distance-weighted mean of the coordinates of their
+    `n_neighbors` nearest landmarks.
+
+    Returns np.ndarray
+    """
+    neighbors = NearestNeighbors(n_neighbors=min(n_neighbors, len(landmark_vecs)), metric=dist_metric)
+    dist, idx = neighbors.fit(landmark_vecs).kneighbors(phrase_vecs)
+    weights = 1 / (dist + 1e-9)
+    return (landmark_coords[idx] * weights[:, :, None]).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+
+def get_projection(phrase_vecs:np.ndarray, method:str = "umap", dist_metric:str = "cosine", umap_neighbors:int = 15,
+                   projection:str = "distance", landmarks:int = None, chunk_size:int = 10000,
+                   random_state:int = 42):
+    """
+    Projects phrase vectors to two dimensions for visualization.
+
+    Options for `projection` are ('distance', 'vectors'). 'distance' projects the rows of the pairwise distance matrix
+    (n x n). 'vectors' projects the phrase vectors directly with `dist_metric` and never builds that matrix, except for
+    MDS. When `landmarks` is set, only that many randomly chosen phrases are projected and the rest are placed with the
+    fitted reducer's `transform` (UMAP, SVD) or at the weighted mean of their nearest landmarks (t-SNE, MDS),
+    `chunk_size` phrases at a time.
+
+    Returns np.ndarray
+    """
+    if projection not in ("distance", "vectors"):
+        raise Exception(f"Unrecognized projection: '{projection}'")
+    phrase_vecs = np.asarray(phrase_vecs)
+
+    # Phrase vectors are compared by angle, so SVD projects unit vectors for 'cosine'
+    if projection == "vectors" and method == "svd" and dist_metric == "cosine":
+        phrase_vecs = normalize(phrase_vecs)
+
+    # Features of each phrase: distances to the reference phrases or the phrase vector itself
+    features = lambda vecs, reference: pairwise_distances(vecs, reference, metric=dist_metric) \
+        if projection == "distance" else vecs
+
+    # t-SNE always projects the phrase vectors
+    if landmarks is None or landmarks >= len(phrase_vecs):
+        all_features = phrase_vecs if method == "tsne" else features(phrase_vecs, phrase_vecs)
+        return fit_projection(all_features, method, dist_metric, umap_neighbors, projection, random_state)[0]
+
+    # Project a random sample of landmark phrases
+    is_landmark = np.zeros(len(phrase_vecs), dtype=bool)
+    is_landmark[np.random.RandomState(random_state).choice(len(phrase_vecs), landmarks, replace=False)] = True
+    landmark_vecs = phrase_vecs[is_landmark]
+    landmark_features = landmark_vecs if method == "tsne" else features(landmark_vecs, landmark_vecs)
+    landmark_coords, reducer = fit_projection(landmark_features, method, dist_metric, umap_neighbors, projection,
+                                              random_state)
+
+    # Place the remaining phrases in chunks
+    coords = np.zeros((len(phrase_vecs), 2))
+    coords[is_landmark] = landmark_coords
+    rest = np.flatnonzero(~is_landmark)
+    for start in range(0, len(rest), chunk_size):
+        chunk = rest[start:start+chunk_size]
+        if reducer is not None:
+            coords[chunk] = reducer.transform(features(phrase_vecs[chunk], landmark_vecs))
+        else:
+            coords[chunk] = place_by_neighbors(phrase_vecs[chunk], landmark_vecs, landmark_coords, dist_metric)
+    return coords
+
+def get_projection_cached(phrase_vecs:np.ndarray, cache_dir:str = None, **kwargs):
+    """
+    Calls `get_projection`, caching the coordinates in `cache_dir` by a fingerprint of the phrase vectors and the
+    projection settings in `kwargs`.
+
+    Returns np.ndarray
+    """
+    if cache_dir is None:
+        return get_projection(phrase_vecs, **kwargs)
+
+    phrase_vecs = np.ascontiguousarray(phrase_vecs)
+    h = hashlib.sha256(json.dumps(kwargs, sort_keys=True).encode('utf-8'))
+    h.update(str((phrase_vecs.shape, phrase_vecs.dtype.str)).encode('utf-8'))
+    h.update(phrase_vecs.data)
+    cache_file = os.path.join(cache_dir, f"projection.{h.hexdigest()}.npy")
+    if os.path.exists(cache_file):
+        return np.load(cache_file)
+
+    coords = get_projection(phrase_vecs, **kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(cache_file, coords)
+    return coords
+
+def downsample_clusters(df:DataFrame, max_points:int, random_state:int = 42):
+    """
+    Randomly samples at most about `max_points` rows of `df`, taking the same fraction of every cluster but at least
+    one row per cluster.
+
+    Returns DataFrame
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+
+    # Shuffle the rows, then keep each cluster's first rows up to its quota
+    shuffled = df.sample(frac=1, random_state=random_state)
+    cluster_sizes = shuffled.cluster.map(shuffled.cluster.value_counts())
+    quotas = np.maximum(1, (cluster_sizes * max_points // len(df)).to_numpy())
+    ranks = shuffled.groupby("cluster").cumcount().to_numpy()
+    return shuffled[ranks < quotas].sort_index()
+
+# Cell
+def get_count_matrix(docs:list, dictionary:gensim.corpora.dictionary.Dictionary):
+    """
+    Counts the tokens of each list of tokens in `docs` that are in `dictionary`.
+
+    Returns scipy.sparse.csc_matrix (terms x documents)
+    """
+    lengths = np.array([len(doc) for doc in docs], dtype=np.int64)
+    token2id = dictionary.token2id
+    term_ids = np.array([token2id.get(token, -1) for doc in docs for token in doc], dtype=np.int64)
+    doc_ids = np.repeat(np.arange(len(docs)), lengths)
+    known = term_ids >= 0
+    counts = sparse.coo_matrix((np.ones(known.sum()), (term_ids[known], doc_ids[known])),
+                               shape=(len(dictionary), len(docs)))
+    return counts.tocsc()
+
+def get_tfidf_matrix(counts:sparse.spmatrix):
+    """
+    Weights a (terms x documents) count matrix the way gensim's default TfidfModel does: term counts times
+    log2(documents / document frequency), with each document scaled to unit length. Terms found in every document have
+    no weight.
+
+    Returns scipy.sparse.csc_matrix
+    """
+    counts = sparse.csr_matrix(counts)
+    doc_freqs = np.diff(counts.indptr)
+    idf = np.log2(counts.shape[1] / np.maximum(doc_freqs, 1))
+    tfidf = sparse.diags(idf) @ counts
+    tfidf = normalize(tfidf.tocsc(), norm='l2', axis=0)
+    tfidf.eliminate_zeros()
+    return tfidf
+
+def get_source_fingerprint(paths:list = None, df:DataFrame = None):
+    """
+    Fingerprints the source of a corpus: the path, size and modification time of each file in `paths`, and/or the
+    contents of `df`.
+
+    Returns str
+    """
+    h = hashlib.sha256()
+    for path in (paths or []):
+        stat = os.stat(path)
+        h.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+    if df is not None:
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def save_corpus_stats(dictionary:gensim.corpora.dictionary.Dictionary, counts:sparse.spmatrix, stats_dir:str,
+                      fingerprint:str = None):
+    """
+    Saves the dictionary and (terms x documents) count matrix of a corpus to `stats_dir`, along with the `fingerprint`
+    of the corpus they were computed from (see `get_source_fingerprint`).
+
+    Returns None
+    """
+    os.makedirs(stats_dir, exist_ok=True)
+    dictionary.save(os.path.join(stats_dir, "dictionary.gensim"))
+    sparse.save_npz(os.path.join(stats_dir, "counts.npz"), sparse.csc_matrix(counts))
+    with open(os.path.join(stats_dir, "source.json"), 'w', encoding='utf-8') as f:
+        json.dump(dict(fingerprint=fingerprint), f)
+
+def load_corpus_stats(stats_dir:str, fingerprint:str = None):
+    """
+    Loads the dictionary and count matrix saved by `save_corpus_stats`. Returns None if there are none or, when
+    `fingerprint` is set, if they were computed from a different corpus.
+
+    Returns (gensim.corpora.dictionary.Dictionary, scipy.sparse.csc_matrix) or None
+    """
+    dictionary_file = os.path.join(stats_dir, "dictionary.gensim")
+    counts_file = os.path.join(stats_dir, "counts.npz")
+    source_file = os.path.join(stats_dir, "source.json")
+    if not (os.path.exists(dictionary_file) and os.path.exists(counts_file)):
+        return None
+
+    # Optionally check that the statistics come from the same corpus
+    if fingerprint is not None:
+        if not os.path.exists(source_file):
+            return None
+        with open(source_file, encoding='utf-8') as f:
+            if json.load(f).get('fingerprint') != fingerprint:
+                return None
+    return corpora.Dictionary.load(dictionary_file), sparse.load_npz(counts_file).tocsc()
+
+def merge_corpus_stats(dictionary:gensim.corpora.dictionary.Dictionary, counts:sparse.spmatrix,
+                       other_dictionary:gensim.corpora.dictionary.Dictionary, other_counts:sparse.spmatrix):
+    """
+    Adds the terms of `other_dictionary` to `dictionary` and appends the documents of `other_counts` after those of
+    `counts`, with its rows moved to the merged term ids. `other_dictionary` and `other_counts` are not modified.
+
+    Returns (gensim.corpora.dictionary.Dictionary, scipy.sparse.csc_matrix)
+    """
+    old2new = dictionary.merge_with(other_dictionary).old2new
+    term_map = np.zeros(len(other_dictionary), dtype=np.int64)
+    term_map[list(old2new.keys())] = list(old2new.values())
+
+    other_counts = sparse.coo_matrix(other_counts)
+    n_terms = len(dictionary)
+    other_counts = sparse.csc_matrix((other_counts.data, (term_map[other_counts.row], other_counts.col)),
+                                     shape=(n_terms, other_counts.shape[1]))
+    counts = sparse.csc_matrix(counts)
+    counts.resize((n_terms, counts.shape[1]))
+    return dictionary, sparse.hstack([counts, other_counts], format='csc')
+
+# Cell
+class HashedVocab(dict):
+    """
+    Maps every token to its id in a gensim HashDictionary. Used as the `token2id` of a HashDictionary so that it can be
+    passed as the `vocab` of `get_phrases` in place of a Dictionary's `token2id`: every token is in the vocabulary.
+    Ids are hashed on every lookup and nothing is stored, so the mapping stays empty however many tokens are looked up.
+    """
+    def __init__(self, hash_dictionary:gensim.corpora.hashdictionary.HashDictionary):
+        super().__init__()
+        self.hash_dictionary = hash_dictionary
+
+    def __getitem__(self, token):
+        return self.hash_dictionary.restricted_hash(token)
+
+    # pandas' Series.map looks tokens up with [] when the mapping defines __missing__
+    def __missing__(self, token):
+        return self[token]
+
+    def __contains__(self, token):
+        return True
+
+    def get(self, token, default=None):
+        return self[token]
+
+def get_hash_dictionary(n_features:int):
+    """
+    Creates a gensim HashDictionary with `n_features` ids whose `token2id` maps any token to its id.
+
+    Returns gensim.corpora.hashdictionary.HashDictionary
+    """
+    dictionary = corpora.HashDictionary(id_range=n_features, debug=False)
+    dictionary.token2id = HashedVocab(dictionary)
+    return dictionary
+
+def get_index_meta(index:dict):
+    """
+    Describes a token index for saving as JSON: the tokens in order of their ids, or the number of ids of a
+    `HashedVocab`, whose tokens are not stored.
+
+    Returns list or dict
+    """
+    if isinstance(index, HashedVocab):
+        return dict(n_features=index.hash_dictionary.id_range)
+    return sorted(index, key=index.get)
+
+def load_index_meta(meta):
+    """
+    Rebuilds the token index described by `get_index_meta`.
+
+    Returns dict
+    """
+    if isinstance(meta, dict):
+        return get_hash_dictionary(meta['n_features']).token2id
+    return {token: i for i, token in enumerate(meta)}
+
+def tokens_to_disk(docs:list, token_file:str, mode:str = "w"):
+    """
+    Writes each list of tokens in `docs` to `token_file` as one JSON list per line, so tokens containing whitespace
+    (e.g. named entities) are kept intact. Use `mode` 'a' to append documents to an existing file.
+
+    Returns None
+    """
+    # Create the output directory if it doesn't exist
+    os.makedirs(os.path.dirname(token_file) or ".", exist_ok=True)
+
+    with open(token_file, mode, encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(list(doc), ensure_ascii=False) + "\n")
+
+def iter_token_file(token_file:str, chunk_size:int):
+    """
+    Reads the documents written by `tokens_to_disk` as lists of at most `chunk_size` lists of tokens.
+
+    Returns generator
+    """
+    with open(token_file, encoding="utf-8") as f:
+        chunk = []
+        for line in f:
+            chunk.append(json.loads(line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def get_kept_terms(doc_freqs:np.ndarray, num_docs:int, no_below:int = 1, no_above:float = 1.0, keep_n:int = None):
+    """
+    Selects the terms that occur in at least `no_below` documents and at most `no_above` (fraction) of documents, then
+    only the `keep_n` most frequent of those, as gensim's `Dictionary.filter_extremes` does.
+
+    Returns np.ndarray (bool mask over terms)
+    """
+    kept = (doc_freqs >= no_below) & (doc_freqs <= no_above * num_docs)
+    if keep_n is not None and kept.sum() > keep_n:
+        ranked = np.nonzero(kept)[0][np.argsort(-doc_freqs[kept], kind='stable')]
+        kept[ranked[keep_n:]] = False
+    return kept
+
+def get_tfidf_matrix_streaming(token_file:str, chunk_size:int = 100000, no_below:int = 1, no_above:float = 1.0,
+                               keep_n:int = None, hashing:bool = False, n_features:int = 2**18, output_dir:str = None):
+    """
+    Creates a TF-IDF matrix from the documents in `token_file` (see `tokens_to_disk`) in two passes of `chunk_size`
+    documents, without holding the tokens of the whole corpus in memory.
+
+    The first pass counts the documents each term occurs in and drops terms as in `get_kept_terms`. Since a term has
+    one entry per document it occurs in, this also gives the layout of the (terms x documents) CSR matrix, which is
+    allocated once. The second pass weights each chunk as in `get_tfidf_matrix` and writes it into its place in that
+    matrix. When `output_dir` is set, the matrix arrays are .npy files there, written and returned memory-mapped (see
+    `load_sparse_matrix`), so the matrix doesn't have to fit in memory. When `hashing` is True, tokens are hashed to
+    `n_features` ids instead of building a vocabulary, and dropped ids keep their (empty) rows.
+
+    Returns (scipy.sparse.csr_matrix, gensim.corpora.dictionary.Dictionary or gensim.corpora.hashdictionary.HashDictionary)
+    """
+    # First pass: document frequencies
+    if hashing:
+        dictionary = get_hash_dictionary(n_features)
+        doc_freqs = np.zeros(n_features, dtype=np.int64)
+        num_docs = 0
+        for docs in iter_token_file(token_file, chunk_size):
+            doc_freqs += np.diff(get_count_matrix(docs, dictionary).tocsr().indptr)
+            num_docs += len(docs)
+        doc_freqs[~get_kept_terms(doc_freqs, num_docs, no_below, no_above, keep_n)] = 0
+    else:
+        dictionary = corpora.Dictionary()
+        for docs in iter_token_file(token_file, chunk_size):
+            dictionary.add_documents(docs, prune_at=None)
+        kept = get_kept_terms(np.array([dictionary.dfs[i] for i in range(len(dictionary))], dtype=np.int64),
+                              dictionary.num_docs, no_below, no_above, keep_n)
+        dictionary.filter_tokens(good_ids=np.nonzero(kept)[0].tolist())
+        doc_freqs = np.array([dictionary.dfs[i] for i in range(len(dictionary))], dtype=np.int64)
+        num_docs = dictionary.num_docs
+
+    # Dropped terms, and terms in every document, have no weight and no entries
+    idf = np.zeros(len(doc_freqs))
+    idf[doc_freqs > 0] = np.log2(num_docs / doc_freqs[doc_freqs > 0])
+    row_nnz = np.where(idf > 0, doc_freqs, 0)
+
+    # Allocate the CSR arrays, with the smallest index type scipy will accept without copying
+    nnz = int(row_nnz.sum())
+    index_dtype = np.int32 if max(nnz, num_docs) < 2**31 else np.int64
+    indptr = np.concatenate([[0], np.cumsum(row_nnz)]).astype(index_dtype)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        np.save(os.path.join(output_dir, "indptr.npy"), indptr)
+        np.save(os.path.join(output_dir, "shape.npy"), np.array([len(doc_freqs), num_docs]))
+        allocate = lambda name, dtype: np.lib.format.open_memmap(os.path.join(output_dir, f"{name}.npy"), mode='w+',
+                                                                   dtype=dtype, shape=(nnz,))
+    else:
+        allocate = lambda name, dtype: np.empty(nnz, dtype=dtype)
+    data, indices = allocate("data", np.float32), allocate("indices", index_dtype)
+
+    # Second pass: weight each chunk of documents and append its entries to the end of each term's row
+    next_entry = indptr[:-1].astype(np.int64)
+    doc_offset = 0
+    for docs in iter_token_file(token_file, chunk_size):
+        tfidf = normalize((sparse.diags(idf) @ get_count_matrix(docs, dictionary)).tocsc(), norm='l2', axis=0).tocsr()
+        tfidf.sort_indices()
+        chunk_nnz = np.diff(tfidf.indptr)
+        rows = np.repeat(np.arange(len(chunk_nnz)), chunk_nnz)
+        positions = next_entry[rows] + np.arange(tfidf.nnz) - tfidf.indptr[rows]
+        data[positions] = tfidf.data
+        indices[positions] = tfidf.indices + doc_offset
+        next_entry += chunk_nnz
+        doc_offset += len(docs)
+
+    if output_dir is not None:
+        data.flush()
+        indices.flush()
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(doc_freqs), num_docs), copy=False), dictionary
+
+def load_sparse_matrix(output_dir:str, mmap:bool = True):
+    """
+    Loads the TF-IDF matrix written to `output_dir` by `get_tfidf_matrix_streaming`. When `mmap` is True, its arrays are
+    memory-mapped instead of read into memory.
+
+    Returns scipy.sparse.csr_matrix
+    """
+    load = lambda name: np.load(os.path.join(output_dir, f"{name}.npy"), mmap_mode='r' if mmap else None)
+    return sparse.csr_matrix((load("data"), load("indices"), load("indptr")), shape=tuple(load("shape")), copy=False)
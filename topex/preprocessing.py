@@ -1,21 +1,70 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: preprocessing.ipynb (unless otherwise specified).
 
-__all__ = ['nlp', 'linker', 'token_filter', 'normalize_entity', 'preprocess_docs', 'get_stop_words']
+__all__ = ['get_nlp', 'get_linker_pipes', 'add_linker', 'LINKER_PIPES', 'token_filter', 'normalize_entity', 'parse_doc',
+           'decode_parsed_doc', 'parse_texts', 'parse_batch', 'iter_parsed_docs', 'preprocess_docs', 'stream_docs',
+           'get_stop_words', 'get_parse_config', 'get_cache_key', 'encode_strings', 'decode_strings',
+           'save_parsed_shard', 'load_parsed_shard', 'add_shard_to_index', 'load_cache_index', 'find_parsed_docs',
+           'get_parsed_doc', 'CACHE_FORMAT', 'PARSED_ARRAYS', 'PARSED_STRINGS']
 
 # Cell
+import hashlib
+import json
+import multiprocessing
+import numpy as np
 import os
-import spacy
+import shutil
+from functools import lru_cache
+from itertools import islice
 from pandas import DataFrame
 import topex.internal as internal
-from scispacy.abbreviation import AbbreviationDetector
-from scispacy.linking import EntityLinker
 from tqdm import tqdm
 
-nlp = spacy.load('en_core_sci_sm', disable=["parser"])
-nlp.add_pipe("sentencizer")
-nlp.add_pipe("abbreviation_detector")
-nlp.add_pipe("scispacy_linker", config={"resolve_abbreviations": True, "linker_name": "mesh"})
-linker = nlp.get_pipe("scispacy_linker")
+LINKER_PIPES = ("abbreviation_detector", "scispacy_linker")
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    """
+    Loads the scispaCy pipeline on first use and caches it. The abbreviation detector and entity linker are not
+    loaded until they are needed (see `get_linker_pipes`).
+    Returns spacy.language.Language
+    """
+    import spacy
+    nlp = spacy.load('en_core_sci_sm', disable=["parser"])
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+@lru_cache(maxsize=None)
+def get_linker_pipes(nlp):
+    """
+    Gets the abbreviation detector and MeSH entity linker for `nlp`. They are created outside of the pipeline, so the
+    linker's knowledge base (roughly 1 GB of RAM, several seconds to load) is never pickled and sent to the worker
+    processes that run `nlp.pipe`; they are only created for NER. Pipes that `nlp` already has are reused.
+    Returns list of (str, callable)
+    """
+    if "scispacy_linker" in nlp.pipe_names:
+        return [(name, pipe) for name, pipe in nlp.pipeline if name in LINKER_PIPES]
+
+    # Importing scispacy registers its pipeline components with spaCy
+    from scispacy.abbreviation import AbbreviationDetector
+    from scispacy.linking import EntityLinker
+    return [("abbreviation_detector", nlp.create_pipe("abbreviation_detector")),
+            ("scispacy_linker", nlp.create_pipe("scispacy_linker",
+                                                config={"resolve_abbreviations": True, "linker_name": "mesh"}))]
+
+def add_linker(nlp):
+    """
+    Gets the MeSH entity linker for `nlp` (see `get_linker_pipes`). The linker is not added to the pipeline.
+    Returns scispacy.linking.EntityLinker
+    """
+    return dict(get_linker_pipes(nlp))["scispacy_linker"]
+
+def __getattr__(name):
+    # Backwards compatibility for the module-level `nlp` and `linker` objects, which are now loaded lazily
+    if name == "nlp":
+        return get_nlp()
+    if name == "linker":
+        return add_linker(get_nlp())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Cell
 def token_filter(token, stopwords:list, custom_stopwords_only:bool=False):
@@ -31,12 +80,14 @@ def token_filter(token, stopwords:list, custom_stopwords_only:bool=False):
 
     return include_token
 
-def normalize_entity(entity):
+def normalize_entity(entity, linker=None):
     """
     For a given entity extracted via NER, attempts to normalize to a canonical name
-    if available, otherwise returns the lemmatized entity.
+    if available, otherwise returns the lemmatized entity. `linker` defaults to the linker of the default pipeline.
     Returns string
     """
+    if linker is None:
+        linker = add_linker(get_nlp())
     name = entity.lemma_
     if len(entity._.kb_ents) > 0 and entity._.kb_ents[0][1] > .8:
        cui = entity._.kb_ents[0][0]
@@ -44,46 +95,195 @@ def normalize_entity(entity):
        name = linked.canonical_name
     return name.lower()
 
+def parse_doc(doc, stopwords:set, custom_stopwords_only:bool=False, ner:bool=False, linker=None):
+    """
+    Extracts the document tokens and the text, tokens and part of speech tags of each sentence from a parsed spaCy
+    document in a single pass over its tokens. Tokens and tags are integer-encoded against `strings`, the distinct
+    strings in the document, and sentence boundaries are stored as offsets into the flat `sent_tokens` and
+    `sent_tags` arrays. The result holds no references to spaCy objects (see `decode_parsed_doc`).
+    Returns dict
+    """
+    strings = {}
+    encode = lambda s: strings.setdefault(s, len(strings))
+    tokens, sent_text, sent_tokens, sent_tags, sent_offsets = [], [], [], [], [0]
+    for sent in doc.sents:
+        for token in sent:
+            # Remove stopwords and any token without alpha characters. spaCy's default stopwords are always removed
+            # from sentences, but only removed from the document tokens when custom_stopwords_only is False.
+            if not token_filter(token, stopwords, custom_stopwords_only=True):
+                continue
+            lemma = encode(token.lemma_.lower())
+            if custom_stopwords_only or not token.is_stop:
+                tokens.append(lemma)
+            if not ner and not token.is_stop:
+                sent_tokens.append(lemma)
+                sent_tags.append(encode(token.pos_))
+
+        # Perform NER instead of tokenization
+        if ner==True:
+            for e in sent.ents:
+                sent_tokens.append(encode(normalize_entity(e, linker)))
+                sent_tags.append(encode('NOUN'))
+
+        sent_text.append(sent.text)
+        sent_offsets.append(len(sent_tokens))
+
+    return dict(strings=list(strings), tokens=np.array(tokens, dtype=np.int32), sent_text=sent_text,
+                sent_tokens=np.array(sent_tokens, dtype=np.int32), sent_tags=np.array(sent_tags, dtype=np.int32),
+                sent_offsets=np.array(sent_offsets, dtype=np.int64))
+
+def decode_parsed_doc(parsed:dict, interned:dict=None):
+    """
+    Converts the output of `parse_doc` into a list of document tokens and a list of (text, tokens, tags) sentences.
+    Pass the same `interned` dict for every document in a corpus so that each distinct token or tag is stored once,
+    no matter how many times it occurs.
+    Returns (list, list)
+    """
+    strings = parsed['strings']
+    if interned is not None:
+        strings = [interned.setdefault(s, s) for s in strings]
+
+    tokens = [strings[i] for i in parsed['tokens'].tolist()]
+    sent_tokens = [strings[i] for i in parsed['sent_tokens'].tolist()]
+    sent_tags = [strings[i] for i in parsed['sent_tags'].tolist()]
+    offsets = parsed['sent_offsets'].tolist()
+    sents = [(text, sent_tokens[start:end], sent_tags[start:end])
+             for text, start, end in zip(parsed['sent_text'], offsets[:-1], offsets[1:])]
+    return tokens, sents
+
+def parse_texts(nlp, texts, stopwords:set, custom_stopwords_only:bool=False, ner:bool=False, linker_pipes:list=(),
+                n_process:int=1, batch_size:int=1000):
+    """
+    Parses an iterable of document texts with `nlp` followed by the `linker_pipes` (see `get_linker_pipes`) and yields
+    the output of `parse_doc` for each document, in order. Linker pipes in `nlp` itself are disabled.
+    Returns generator
+    """
+    linker = dict(linker_pipes).get("scispacy_linker")
+    with nlp.select_pipes(disable=[name for name in nlp.pipe_names if name in LINKER_PIPES]):
+        for doc in nlp.pipe(texts, n_process=n_process, batch_size=batch_size):
+            for name, pipe in linker_pipes:
+                doc = pipe(doc)
+            yield parse_doc(doc, stopwords, custom_stopwords_only, ner, linker)
+
+# Arguments of `parse_texts` inherited by forked workers of `iter_parsed_docs`
+_fork_parse_args = None
+
+def parse_batch(texts:list):
+    """
+    Parses a batch of texts in a forked worker of `iter_parsed_docs`.
+    Returns list of dict
+    """
+    nlp, stopwords, custom_stopwords_only, ner, linker_pipes = _fork_parse_args
+    return list(parse_texts(nlp, texts, stopwords, custom_stopwords_only, ner, linker_pipes))
+
+def iter_parsed_docs(texts, stopwords:list, custom_stopwords_only:bool=False, ner:bool=False, n_process:int=1,
+                     batch_size:int=1000, nlp=None, cache_dir:str=None, chunk_size:int=10000):
+    """
+    Parses an iterable of document texts and yields the output of `parse_doc` for each document, in order.
+    Texts are read `chunk_size` at a time and each spaCy Doc is discarded as soon as it has been parsed, so memory use
+    doesn't grow with the size of the corpus. Documents found in `cache_dir` are read from the cache instead of parsed,
+    and the documents parsed in each chunk are added to it as one shard (see `save_parsed_shard`).
+    With `ner` and `n_process` > 1, documents are parsed and linked in a pool of worker processes forked after the
+    linker pipes are created, so the workers share the linker's knowledge base copy-on-write instead of each loading
+    it. Where fork isn't available (Windows, and macOS where spaCy uses spawn), only `nlp.pipe` runs in parallel and
+    abbreviation detection and entity linking run in this process.
+    Returns generator
+    """
+    global _fork_parse_args
+    if nlp is None:
+        nlp = get_nlp()
+    stopwords = set(stopwords)
+    config = get_parse_config(nlp, stopwords, custom_stopwords_only, ner) if cache_dir is not None else None
+    index = load_cache_index(cache_dir) if cache_dir is not None else None
+    shards = {}
+    linker_pipes, pool = [], None
+
+    texts = iter(texts)
+    try:
+        while True:
+            chunk = list(islice(texts, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            # Load previously parsed documents from the memory-mapped cache shards
+            parsed = [None] * len(chunk)
+            if cache_dir is not None:
+                keys = [get_cache_key(text, config) for text in chunk]
+                for i, found in enumerate(find_parsed_docs(index, keys)):
+                    if found is not None:
+                        shard, position = found
+                        if shard not in shards:
+                            shards[shard] = load_parsed_shard(cache_dir, shard)
+                        parsed[i] = get_parsed_doc(shards[shard], position)
+            missing = [i for i, p in enumerate(parsed) if p is None]
+            if ner and missing and not linker_pipes:
+                linker_pipes = get_linker_pipes(nlp)
+
+                # Fork the workers once the linker pipes exist, so they inherit them rather than loading their own
+                if n_process > 1 and "fork" in multiprocessing.get_all_start_methods():
+                    _fork_parse_args = (nlp, stopwords, custom_stopwords_only, ner, linker_pipes)
+                    pool = multiprocessing.get_context("fork").Pool(n_process)
+
+            if pool is not None:
+                size = max(1, min(batch_size, -(-len(missing) // n_process)))
+                batches = [[chunk[i] for i in missing[start:start + size]] for start in range(0, len(missing), size)]
+                results = (p for batch in pool.imap(parse_batch, batches) for p in batch)
+            else:
+                # spaCy's workers only tokenize, tag and find entities; the linker pipes run in this process
+                results = parse_texts(nlp, (chunk[i] for i in missing), stopwords, custom_stopwords_only, ner,
+                                      linker_pipes, n_process, batch_size)
+            for i, p in zip(missing, results):
+                parsed[i] = p
+
+            # Optionally cache the newly parsed documents of the chunk as one shard
+            if cache_dir is not None and missing:
+                shard = save_parsed_shard(cache_dir, [keys[i] for i in missing], [parsed[i] for i in missing])
+                add_shard_to_index(index, cache_dir, shard)
+
+            yield from parsed
+    finally:
+        if pool is not None:
+            pool.terminate()
+            _fork_parse_args = None
+
 def preprocess_docs(doc_df:DataFrame, save_results:bool=False, file_name:str=None, stop_words_file:str=None,
-                stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False):
+                stop_words_list:list=None, custom_stopwords_only:bool=False, ner:bool=False, n_process:int=1,
+                batch_size:int=1000, nlp=None, cache_dir:str=None):
     """
     Imports and pre-processes the documents from the `raw_docs` dataframe
     Document pre-processing is handled in [`tokenize_and_stem`](/topex/preprocessing#tokenize_and_stem).
     `path_to_file_list` is a path to a text file containing a list of files to be processed separated by line breaks.
     `ner` runs a biomedical NER pipeline over the input and clusters on extracted entities rather than tokens.
+    `n_process` is the number of worker processes used to parse documents and `batch_size` is the number of documents
+    sent to a worker at a time. Results are returned in the same order regardless of `n_process`.
+    `nlp` is an optional, preconfigured spaCy pipeline. By default, the scispaCy pipeline is loaded on first use.
+    For NER, the abbreviation detector and entity linker run in this process, outside of the pipeline (see
+    `get_linker_pipes`).
+    When `cache_dir` is set, parse results are cached on disk by document content and settings, so only new or
+    changed documents are parsed with spaCy on later runs.
     Returns (DataFrame, DataFrame)
     """
+    if nlp is None:
+        nlp = get_nlp()
+
     # 1) Get Stopwords
     stopwords = get_stop_words(stop_words_file=stop_words_file,stop_words_list=stop_words_list)
 
     # 2) Process docs with spaCy
     texts = list(doc_df.text)
-    docs = list(nlp.pipe(texts))
-
-    # 3) Create DataFrame of documents
-    # Remove stopwords and any token without alpha characters
-    doc_df['tokens'] = [[token.lemma_.lower() for token in doc if token_filter(token,stopwords,custom_stopwords_only)] for doc in docs]
-
-    # 4) Create DataFrame of sentences
-    rows = []
-    corpus_tokens = []
-    for doc_id, doc in tqdm(enumerate(docs), total=len(docs)):
-        doc_tokens = []
-        for sent_id, sent in enumerate(doc.sents):
-            uid = f"doc.{doc_id}.sent.{sent_id}"
-            if ner==True:
-                # Perform NER instead of tokenization
-                sent_tokens = [normalize_entity(e) for e in sent.ents]
-                lemmas = sent_tokens
-                tags = ['NOUN' for t in sent_tokens]
-            else:
-                # Remove stopwords and any token without alpha characters
-                sent_tokens = list([token for token in sent if token_filter(token,stopwords,custom_stopwords_only=False)])
-                lemmas = [t.lemma_.lower() for t in sent_tokens]
-                tags = [t.pos_ for t in sent_tokens]
-            rows.append((uid,doc_id,sent_id,sent.text,lemmas,tags))
-            doc_tokens = doc_tokens + sent_tokens
-        corpus_tokens.append(doc_tokens)
+    parsed = iter_parsed_docs(texts, stopwords, custom_stopwords_only, ner, n_process=n_process, batch_size=batch_size,
+                              nlp=nlp, cache_dir=cache_dir, chunk_size=max(len(texts), 1))
+
+    # 3) Collect the tokens of each document and the rows of each sentence
+    doc_tokens, rows, interned = [], [], {}
+    for doc_id, p in tqdm(enumerate(parsed), total=len(texts)):
+        tokens, sents = decode_parsed_doc(p, interned)
+        doc_tokens.append(tokens)
+        rows += [(f"doc.{doc_id}.sent.{sent_id}", doc_id, sent_id, text, lemmas, tags)
+                 for sent_id, (text, lemmas, tags) in enumerate(sents)]
+
+    # 4) Create DataFrames of documents and sentences
+    doc_df['tokens'] = doc_tokens
     data = DataFrame(rows, columns=['id','doc_id','sent_id','text','tokens','pos_tags'])
 
     # Optionally save the results to disk
@@ -92,6 +292,62 @@ def preprocess_docs(doc_df:DataFrame, save_results:bool=False, file_name:str=Non
 
     return data, doc_df
 
+def stream_docs(raw_doc_chunks, file_name:str, doc_file_name:str, stop_words_file:str=None, stop_words_list:list=None,
+                custom_stopwords_only:bool=False, ner:bool=False, n_process:int=1, batch_size:int=1000, nlp=None,
+                cache_dir:str=None):
+    """
+    Pre-processes documents arriving as an iterable of DataFrames (with "doc_name" and "text" columns) and writes the
+    sentence table to `file_name` and the document table to `doc_file_name` as Parquet files, one row group per chunk.
+    Only one chunk is held in memory at a time. Writing Parquet requires the optional `pyarrow` package.
+    Returns (int, int) the number of documents and sentences written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Streaming import requires pyarrow. Install it with `pip install pyarrow`.")
+
+    stopwords = get_stop_words(stop_words_file=stop_words_file,stop_words_list=stop_words_list)
+    if nlp is None:
+        nlp = get_nlp()
+
+    tokens_type = pa.list_(pa.string())
+    sent_schema = pa.schema([('id', pa.string()), ('doc_id', pa.int64()), ('sent_id', pa.int64()),
+                             ('text', pa.string()), ('tokens', tokens_type), ('pos_tags', tokens_type)])
+    doc_schema = pa.schema([('id', pa.int64()), ('doc_name', pa.string()), ('text', pa.string()),
+                            ('tokens', tokens_type)])
+
+    # Create the output directories if they don't exist
+    for f in (file_name, doc_file_name):
+        os.makedirs(os.path.dirname(f) or '.', exist_ok=True)
+
+    doc_cnt, sent_cnt = 0, 0
+    with pq.ParquetWriter(file_name, sent_schema) as sent_writer, pq.ParquetWriter(doc_file_name, doc_schema) as doc_writer:
+        for raw_docs in raw_doc_chunks:
+            texts = list(raw_docs.text)
+            parsed = iter_parsed_docs(texts, stopwords, custom_stopwords_only, ner, n_process=n_process,
+                                      batch_size=batch_size, nlp=nlp, cache_dir=cache_dir,
+                                      chunk_size=max(len(texts), 1))
+
+            # Document ids continue across chunks
+            doc_ids = range(doc_cnt, doc_cnt + len(texts))
+            doc_rows = dict(id=list(doc_ids), doc_name=list(raw_docs.doc_name.astype(str)), text=texts, tokens=[])
+            sent_rows, interned = [], {}
+            for doc_id, p in zip(doc_ids, parsed):
+                tokens, sents = decode_parsed_doc(p, interned)
+                doc_rows['tokens'].append(tokens)
+                sent_rows += [(f"doc.{doc_id}.sent.{sent_id}", doc_id, sent_id, text, lemmas, tags)
+                              for sent_id, (text, lemmas, tags) in enumerate(sents)]
+            sents = DataFrame(sent_rows, columns=sent_schema.names)
+
+            doc_writer.write_table(pa.Table.from_pydict(doc_rows, schema=doc_schema))
+            sent_writer.write_table(pa.Table.from_pandas(sents, schema=sent_schema, preserve_index=False))
+            doc_cnt += len(texts)
+            sent_cnt += len(sents)
+            print(f"Processed {doc_cnt} documents ({sent_cnt} sentences)")
+
+    return doc_cnt, sent_cnt
+
 def get_stop_words(stop_words_file:str=None, stop_words_list:list=None):
     """
     Gets a list of all stop words.
@@ -107,4 +363,145 @@ def get_stop_words(stop_words_file:str=None, stop_words_list:list=None):
     if stop_words_list is not None:
         custom_stop_words |= set(stop_words_list)
 
-    return list(set([w.lower() for w in custom_stop_words]))
\ No newline at end of file
+    return list(set([w.lower() for w in custom_stop_words]))
+
+# Cell
+# Version of the layout of cached documents, bump when it changes
+CACHE_FORMAT = 3
+
+def get_parse_config(nlp, stopwords:list, custom_stopwords_only:bool, ner:bool):
+    """
+    Describes everything other than the document text that affects how a document is parsed: the spaCy model and
+    version, the stopwords and the tokenization options.
+    Returns string
+    """
+    import spacy
+    config = dict(format=CACHE_FORMAT, model=nlp.meta.get('name'), version=nlp.meta.get('version'), spacy=spacy.__version__,
+                  pipes=[name for name in nlp.pipe_names if name not in LINKER_PIPES], stopwords=sorted(stopwords),
+                  custom_stopwords_only=custom_stopwords_only, ner=ner, linker="mesh" if ner else None)
+    return json.dumps(config, sort_keys=True)
+
+def get_cache_key(text:str, config:str):
+    """
+    Gets the content hash identifying a document parsed with the given `config`.
+    Returns string
+    """
+    return hashlib.sha256(f"{config}\0{text}".encode("utf-8")).hexdigest()
+
+def encode_strings(strings:list):
+    """
+    Packs a list of strings into a single UTF-8 byte array and an array of offsets into it.
+    Returns (np.ndarray, np.ndarray)
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def decode_strings(data:np.ndarray, offsets:np.ndarray):
+    """
+    Unpacks a list of strings packed with `encode_strings`.
+    Returns list
+    """
+    raw = data.tobytes()
+    return [raw[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+# Integer and string list fields of `parse_doc` output, stored as columns of a cache shard
+PARSED_ARRAYS = dict(tokens=np.int32, sent_tokens=np.int32, sent_tags=np.int32, sent_offsets=np.int64)
+PARSED_STRINGS = ('strings', 'sent_text')
+
+def save_parsed_shard(cache_dir:str, keys:list, parsed:list):
+    """
+    Writes the outputs of `parse_doc` for a chunk of documents to the cache as one shard: a directory of .npy columns
+    holding the arrays and strings of all its documents back to back, with the offsets of each document, and the
+    `keys` of the documents in order.
+    Returns string (the name of the shard)
+    """
+    arrays = dict(keys=np.array(keys, dtype='S64'))
+    for name, dtype in PARSED_ARRAYS.items():
+        parts = [p[name] for p in parsed]
+        arrays[name] = np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+        arrays[f"{name}_ptr"] = np.concatenate([[0], np.cumsum([len(x) for x in parts], dtype=np.int64)])
+    for name in PARSED_STRINGS:
+        parts = [p[name] for p in parsed]
+        arrays[f"{name}_data"], arrays[f"{name}_offsets"] = encode_strings([s for part in parts for s in part])
+        arrays[f"{name}_ptr"] = np.concatenate([[0], np.cumsum([len(x) for x in parts], dtype=np.int64)])
+
+    # Write to a temporary directory first so concurrent runs never read a partially written shard
+    shard = hashlib.sha256(arrays['keys'].tobytes()).hexdigest()[:32]
+    shard_dir = os.path.join(cache_dir, "shards", shard)
+    if os.path.isdir(shard_dir):
+        return shard
+    tmp_dir = f"{shard_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    try:
+        os.replace(tmp_dir, shard_dir)
+    except OSError:
+        # Another run wrote the same shard first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return shard
+
+def load_parsed_shard(cache_dir:str, shard:str):
+    """
+    Memory-maps the columns of a shard written by `save_parsed_shard`.
+    Returns dict
+    """
+    shard_dir = os.path.join(cache_dir, "shards", shard)
+    return {name[:-4]: np.load(os.path.join(shard_dir, name), mmap_mode='r', allow_pickle=False)
+            for name in os.listdir(shard_dir) if name.endswith('.npy')}
+
+def add_shard_to_index(index:dict, cache_dir:str, shard:str):
+    """
+    Adds the keys of a shard to `index`, which maps each shard to its sorted keys and their positions in the shard.
+    Returns None
+    """
+    keys = np.load(os.path.join(cache_dir, "shards", shard, "keys.npy"), allow_pickle=False)
+    order = np.argsort(keys, kind='stable')
+    index[shard] = (keys[order], order)
+
+def load_cache_index(cache_dir:str):
+    """
+    Reads the keys of every shard in the cache (see `add_shard_to_index`).
+    Returns dict
+    """
+    index = {}
+    shards_dir = os.path.join(cache_dir, "shards")
+    if os.path.isdir(shards_dir):
+        for shard in sorted(os.listdir(shards_dir)):
+            # Skip shards that are still being written
+            if "." not in shard:
+                add_shard_to_index(index, cache_dir, shard)
+    return index
+
+def find_parsed_docs(index:dict, keys:list):
+    """
+    Looks up each of `keys` in the cache `index`.
+    Returns list of (shard, position) or None for each key
+    """
+    keys = np.array(keys, dtype='S64')
+    found = [None] * len(keys)
+    for shard, (sorted_keys, order) in index.items():
+        if len(sorted_keys) == 0:
+            continue
+        ix = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        for i in np.nonzero(sorted_keys[ix] == keys)[0]:
+            if found[i] is None:
+                found[i] = (shard, int(order[ix[i]]))
+    return found
+
+def get_parsed_doc(shard:dict, position:int):
+    """
+    Reads the output of `parse_doc` for the document at `position` in a shard loaded with `load_parsed_shard`.
+    Returns dict
+    """
+    parsed = {}
+    for name in PARSED_ARRAYS:
+        ptr = shard[f"{name}_ptr"]
+        parsed[name] = np.asarray(shard[name][ptr[position]:ptr[position + 1]])
+    for name in PARSED_STRINGS:
+        start, end = shard[f"{name}_ptr"][position:position + 2]
+        offsets = np.asarray(shard[f"{name}_offsets"][start:end + 1])
+        parsed[name] = decode_strings(shard[f"{name}_data"][offsets[0]:offsets[-1]], offsets - offsets[0])
+    return parsed